@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gallery.querycount.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -135,3 +136,106 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
+
+# Downloads
+# Set DOWNLOAD_OFFLOAD to 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) to let the
+# front proxy stream image downloads. For nginx, DOWNLOAD_ACCEL_REDIRECT_PREFIX must map to an
+# `internal` location aliased to MEDIA_ROOT.
+
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD')
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Spam checking
+# Comments are only sent to Akismet when an API key is configured.
+
+AKISMET_API_KEY = os.environ.get('AKISMET_API_KEY')
+SITE_URL = os.environ.get('SITE_URL', 'http://localhost:8000')
+
+# Near-duplicate detection
+# Seconds before the in-process perceptual hash index is rebuilt from the database.
+
+SIMILARITY_INDEX_TTL = 300
+
+# Background tasks
+# Queued in the database and processed by `manage.py run_workers`.
+
+TASK_WORKER_PROCESSES = 2
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BACKOFF = 30  # seconds, doubled after each failed attempt
+TASK_RETRY_BACKOFF_MAX = 3600
+TASK_LOCK_TIMEOUT = 600  # seconds before a task left running by a dead worker is retried
+TASKS_ALWAYS_EAGER = False  # run tasks in-process after commit instead of queueing them
+
+# View counting
+# Views are buffered in each process and written in batches, see gallery.viewcounts.
+VIEW_COUNT_FLUSH_INTERVAL = 10  # seconds a view may wait before it is written
+VIEW_COUNT_MAX_PENDING = 1000  # buffered rows that trigger an early flush
+
+# Trending
+# Scores are recomputed by the `update_trending_scores` task every TRENDING_UPDATE_INTERVAL seconds.
+TRENDING_UPDATE_INTERVAL = 600
+TRENDING_HALF_LIFE = 48  # hours for an event to lose half its weight
+TRENDING_WINDOW = 14  # days of events read on each run
+# TRENDING_WEIGHTS = {'like': 3.0}  # overrides gallery.trending.DEFAULT_WEIGHTS per event
+
+# Tag autocomplete
+# Seconds before the in-process tag index is rebuilt to pick up changes made by other processes.
+TAG_INDEX_TTL = 300
+
+# Follow graph
+# Each user's followed ids are cached for privacy filtering and dropped when their follows change.
+FOLLOW_CACHE_TIMEOUT = 3600
+
+# Caches
+# Local memory in development. Set REDIS_URL in production so every process shares the
+# follow cache and the anonymous page cache, and sees the same invalidations.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'pages': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'pages',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'pages': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pages',
+        },
+    }
+
+# Anonymous gallery pages, see gallery.pagecache.
+PAGE_CACHE_ALIAS = 'pages'
+PAGE_CACHE_TIMEOUT = 300  # seconds; uploads, approvals and privacy changes invalidate sooner
+CARD_CACHE_TIMEOUT = 86400  # rendered gallery cards, keyed by Image.card_version
+
+# Query budgets
+# Most queries each view may run per request, by URL name. gallery.querycount logs requests
+# that go over, and gallery.tests fails when a view exceeds its budget or its count grows
+# with the number of rows on the page.
+QUERY_BUDGETS = {
+    'gallery': 6,
+    'tagged_images': 7,
+    'albums': 4,
+    'tags': 1,
+    'search': 6,
+    'image_detail': 7,
+    'album_detail': 6,
+    'user_gallery': 7,
+    'user_profile': 7,
+    'profile': 7,
+    'user_albums': 4,
+    'admin_pending_images': 4,
+    'admin_reported_images': 4,
+    'admin_reported_comments': 4,
+}
+QUERY_COUNT_HEADER = DEBUG  # adds X-Query-Count to every response
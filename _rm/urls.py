@@ -30,6 +30,7 @@ urlpatterns = [
     path('gallery/tag/<int:tag_id>/', views.gallery, name='tagged_images'),
     path('explore/albums/', views.album_gallery, name='albums'),
     path('explore/tags/', views.tags_view, name='tags'),
+    path('explore/tags/autocomplete/', views.tag_autocomplete, name='tag_autocomplete'),
     path('search/', views.search, name='search'),
 
     #--------------------------#
@@ -58,6 +59,7 @@ urlpatterns = [
     path('image/<int:image_id>/download/', interactions.download_image, name='download_image'),
     path('image/<int:image_id>/like/', interactions.like_image, name='like_image'),
     path('image/<int:image_id>/favorite/', interactions.favorite_image, name='favorite_image'),
+    path('image/<int:image_id>/similar/', views.similar_images, name='similar_images'),
 
     #--------------------------#
     # Album Interaction URLs   #
@@ -67,6 +69,7 @@ urlpatterns = [
     path('report_album/<int:album_id>/', interactions.report_album_view, name='report_album'),
     path('set_cover_image/', interactions.set_cover_image, name='set_cover_image'),
     path('save_image_order/<int:album_id>/', interactions.save_image_order, name='save_image_order'),
+    path('move_album_image/<int:album_id>/', interactions.move_album_image, name='move_album_image'),
 
     #--------------------------#
     # Profile URLs             #
@@ -100,6 +103,7 @@ urlpatterns = [
     #--------------------------#
     path('admin/reported-images/resolve/<int:report_id>/', interactions.admin_resolve_report, name='admin_resolve_report'),
     path('admin/pending-images/approve/<int:image_id>/', interactions.admin_approve_image, name='admin_approve_image'),
+    path('admin/moderate/', interactions.admin_bulk_moderate, name='admin_bulk_moderate'),
     
     path('admin/', admin.site.urls),
 ]
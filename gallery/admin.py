@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import AlbumImage, UserProfile, Image, Tag, Category, Report, Comment, Like, Favorite, Album, AlbumLike, AlbumFavorite, AlbumImage
+from .models import AlbumImage, UserProfile, Image, Tag, Category, Report, Comment, Like, Favorite, Album, AlbumLike, AlbumFavorite, AlbumImage, Task
 
 class ImageAdmin(admin.ModelAdmin):
     list_display = ('title', 'user', 'uploaded_at', 'moderation_status', 'width', 'height', 'format', 'size')  # Add new fields to list view
@@ -7,6 +7,11 @@ class ImageAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description')  # Allow search by title or description
     readonly_fields = ('width', 'height', 'format', 'size')  # Allow search by title or description
 
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_after', 'created_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('last_error',)
+
 # Registering models in the admin interface
 admin.site.register(UserProfile)
 admin.site.register(Image, ImageAdmin)
@@ -20,4 +25,5 @@ admin.site.register(Album)
 admin.site.register(AlbumImage)
 admin.site.register(AlbumLike)
 admin.site.register(AlbumFavorite)
+admin.site.register(Task, TaskAdmin)
 
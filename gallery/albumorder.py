@@ -0,0 +1,88 @@
+from django.db import transaction
+from django.db.models import Max
+
+from .tasks import enqueue_once
+
+# Images are ranked ORDER_GAP apart so that a move can take the midpoint of its new
+# neighbours and update a single row. Each move into the same slot halves the gap; once
+# it is used up the album is renumbered.
+ORDER_GAP = 1024
+
+
+def _lock_album(album_id):
+    """Locks the album row so concurrent reorders of one album run one after another."""
+    from .models import Album
+
+    return Album.objects.select_for_update().only('id').get(pk=album_id)
+
+
+def next_order(album):
+    """The rank that puts a new image after the last one in ``album``."""
+    last = album.albumimage_set.aggregate(last=Max('order'))['last']
+    return (last or 0) + ORDER_GAP
+
+
+def append_image(album, image):
+    """Adds ``image`` at the end of ``album``; an image already in it stays where it is."""
+    album.images.add(image, through_defaults={'order': next_order(album)})
+
+
+def renumber(album_id):
+    """Spreads the ranks of ``album_id`` ORDER_GAP apart again, keeping their order."""
+    return reorder(album_id, [])
+
+
+def reorder(album_id, image_ids):
+    """
+    Puts the images of ``album_id`` in the order of ``image_ids``, followed by any images
+    left out of it in their current order. The album is read once and the changed ranks
+    are written with one bulk UPDATE, all in one transaction. Returns the rows changed.
+    """
+    from .models import AlbumImage
+
+    with transaction.atomic():
+        _lock_album(album_id)
+        rows = list(AlbumImage.objects.filter(album_id=album_id).only('id', 'image_id', 'order').order_by('order', 'id'))
+        position = {image_id: index for index, image_id in enumerate(dict.fromkeys(image_ids))}
+        rows.sort(key=lambda row: position.get(row.image_id, len(position)))  # stable for the rest
+        changed = []
+        for index, row in enumerate(rows, 1):
+            if row.order != index * ORDER_GAP:
+                row.order = index * ORDER_GAP
+                changed.append(row)
+        AlbumImage.objects.bulk_update(changed, ['order'], batch_size=500)
+    return len(changed)
+
+
+def move(album_id, image_id, after=None):
+    """
+    Moves one image of ``album_id`` to just after the image ``after``, or to the front when
+    ``after`` is None, by giving it the midpoint rank of its new neighbours. Only the
+    moved row is written unless the gap is used up, in which case the album is renumbered
+    first; a gap about to run out queues a renumbering in the background.
+    """
+    from .models import AlbumImage
+
+    with transaction.atomic():
+        _lock_album(album_id)
+        images = AlbumImage.objects.filter(album_id=album_id)
+        moved = images.get(image_id=image_id)
+        anchor = images.get(image_id=after) if after is not None else None
+        previous = anchor.order if anchor else 0
+        # Ranks equal to the previous one (left by older, unspread orders) leave no gap.
+        following = (
+            images.filter(order__gte=previous).exclude(pk__in=[moved.pk, anchor and anchor.pk])
+            .order_by('order').values_list('order', flat=True).first()
+        )
+        if following is None:
+            rank = previous + ORDER_GAP
+        elif following - previous < 2:
+            # No rank is left between the neighbours.
+            renumber(album_id)
+            return move(album_id, image_id, after)
+        else:
+            rank = (previous + following) // 2
+            if min(rank - previous, following - rank) < 2:
+                enqueue_once('renumber_album_images', album_id=album_id)
+        images.filter(pk=moved.pk).update(order=rank)
+    return rank
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class GalleryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gallery'
+
+    def ready(self):
+        from .search import ensure_search_index
+
+        # The full-text search table is not managed by migrations.
+        post_migrate.connect(ensure_search_index, sender=self)
@@ -0,0 +1,158 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+# Prefixes this short match so many tags that their suggestions are memoized.
+MEMO_PREFIX_LENGTH = 2
+
+
+class TagIndex:
+    """
+    Sorted array of approved tag names, searched with ``bisect`` so a prefix lookup costs
+    two binary searches plus a top-k pass over the matching slice. Suggestions are ordered
+    by the number of images carrying each tag.
+    """
+
+    def __init__(self):
+        self.keys = []  # sorted (casefolded name, tag id)
+        self.names = {}  # tag id -> (key, name)
+        self.usage = {}  # tag id -> number of images
+        self.memo = {}
+        self.built_at = time.monotonic()
+
+    def load(self):
+        from .models import ModerationStatus, Tag
+
+        rows = (
+            Tag.objects.filter(moderation_status=ModerationStatus.APPROVED)
+            .annotate(usage=Count('images'))
+            .values_list('id', 'name', 'usage')
+        )
+        for tag_id, name, usage in rows.iterator():
+            key = (name.casefold(), tag_id)
+            self.keys.append(key)
+            self.names[tag_id] = (key, name)
+            self.usage[tag_id] = usage
+        self.keys.sort()
+
+    def put(self, tag_id, name, usage=0):
+        """Adds a tag used by ``usage`` images, or renames an indexed one."""
+        if tag_id in self.names:
+            if self.names[tag_id][1] == name:
+                return
+            self.remove(tag_id, keep_usage=True)
+        key = (name.casefold(), tag_id)
+        insort(self.keys, key)
+        self.names[tag_id] = (key, name)
+        self.usage.setdefault(tag_id, usage)
+        self.memo.clear()
+
+    def remove(self, tag_id, keep_usage=False):
+        entry = self.names.pop(tag_id, None)
+        if entry is None:
+            return
+        del self.keys[bisect_left(self.keys, entry[0])]
+        if not keep_usage:
+            self.usage.pop(tag_id, None)
+        self.memo.clear()
+
+    def count(self, deltas):
+        """Applies ``{tag id: change}`` to the usage counts."""
+        for tag_id, delta in deltas.items():
+            if tag_id in self.usage:
+                self.usage[tag_id] = max(self.usage[tag_id] + delta, 0)
+        self.memo.clear()
+
+    def complete(self, prefix, limit=10):
+        """Returns up to ``limit`` ``(tag id, name, usage)`` tuples whose name starts with ``prefix``, most used first."""
+        prefix = prefix.casefold()
+        memoize = len(prefix) <= MEMO_PREFIX_LENGTH
+        if memoize and (prefix, limit) in self.memo:
+            return self.memo[prefix, limit]
+        lo = bisect_left(self.keys, (prefix,))
+        hi = bisect_left(self.keys, (prefix + '\U0010ffff',))
+        best = heapq.nsmallest(limit, self.keys[lo:hi], key=lambda key: (-self.usage[key[1]], key))
+        results = [(tag_id, self.names[tag_id][1], self.usage[tag_id]) for _, tag_id in best]
+        if memoize:
+            self.memo[prefix, limit] = results
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+# Set while one thread loads the replacement index; changes applied meanwhile go to the
+# journal and are replayed onto the new index before it is swapped in.
+_rebuilding = False
+_journal = []
+
+
+def get_tag_index():
+    """
+    Returns the process-wide tag index. Signals keep it current within this process, and it
+    is rebuilt after ``TAG_INDEX_TTL`` seconds to pick up changes made by other processes.
+    One thread rebuilds, outside the lock, while lookups keep using the old index; a lookup
+    with no index to fall back on loads one for itself.
+    """
+    global _index, _rebuilding, _journal
+    with _index_lock:
+        ttl = getattr(settings, 'TAG_INDEX_TTL', 300)
+        if _index is not None and (time.monotonic() - _index.built_at <= ttl or _rebuilding):
+            return _index
+        builder = not _rebuilding
+        if builder:
+            _rebuilding, _journal = True, []
+    try:
+        index = TagIndex()
+        index.load()
+        if not builder:
+            return index
+        with _index_lock:
+            for method, args in _journal:
+                getattr(index, method)(*args)
+            _index = index
+            return _index
+    finally:
+        if builder:
+            with _index_lock:
+                _rebuilding, _journal = False, []
+
+
+def complete_tags(prefix, limit=10):
+    index = get_tag_index()
+    with _index_lock:
+        return index.complete(prefix, limit)
+
+
+def _apply(method, *args):
+    # Changes are applied once committed, and only to an index this process has already built.
+    def apply():
+        with _index_lock:
+            if _index is not None:
+                getattr(_index, method)(*args)
+            # Usage deltas may already be in the rebuild's snapshot; only idempotent changes are replayed.
+            if _rebuilding and method != 'count':
+                _journal.append((method, args))
+    transaction.on_commit(apply)
+
+
+def tag_saved(tag, created):
+    from .models import ModerationStatus
+
+    if tag.moderation_status == ModerationStatus.APPROVED:
+        _apply('put', tag.pk, tag.name, 0 if created else tag.images.count())
+    else:
+        _apply('remove', tag.pk)
+
+
+def tag_deleted(tag_id):
+    _apply('remove', tag_id)
+
+
+def tag_usage_changed(deltas):
+    if deltas:
+        _apply('count', dict(deltas))
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .pagecache import page_cache
+
+CARD_TEMPLATE = 'components/image_card.html'
+
+# Slots left in the cached markup for the viewer's own state: (slot, markup when off, markup when on, image flag).
+OVERLAYS = [
+    ('<!--card:like-->', '<i class="far fa-thumbs-up"></i>', '<i class="fas fa-thumbs-up"></i>', 'user_has_liked'),
+    ('<!--card:favorite-->', '<i class="far fa-star"></i>', '<i class="fas fa-star"></i>', 'user_has_favorited'),
+]
+
+
+def card_key(image):
+    return f'gallery:card:{image.pk}:{image.card_version}'
+
+
+def overlay(html, image):
+    """Fills the viewer-specific slots of a cached card from the image's like and favourite flags."""
+    for slot, off, on, flag in OVERLAYS:
+        html = html.replace(slot, on if getattr(image, flag, False) else off, 1)
+    return mark_safe(html)
+
+
+def render_cards(images):
+    """
+    Returns the card markup of each image. Cards are shared by every viewer and cached under
+    the image's ``card_version``, so a page costs one multi-get; only missing cards are
+    rendered, and the viewer's like and favourite state is patched in afterwards.
+    """
+    cache = page_cache()
+    keys = [card_key(image) for image in images]
+    cached = cache.get_many(keys)
+    rendered = {}
+    cards = []
+    for image, key in zip(images, keys):
+        html = cached.get(key)
+        if html is None:
+            html = rendered[key] = render_to_string(CARD_TEMPLATE, {'image': image})
+        cards.append(overlay(html, image))
+    if rendered:
+        cache.set_many(rendered, getattr(settings, 'CARD_CACHE_TIMEOUT', 86400))
+    return cards
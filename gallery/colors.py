@@ -0,0 +1,74 @@
+import math
+import re
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Sum, Value, When
+
+from .imaging import COLOR_LEVELS
+
+HEX_RE = re.compile(r'^#?([0-9a-fA-F]{6})$')
+
+# Maximum distance, in RGB units, between a searched colour and the centre of a matching bin.
+COLOR_SEARCH_RADIUS = 110
+
+# Images whose matching bins cover less than this fraction of their pixels are left out.
+MIN_COLOR_SCORE = 0.05
+
+
+def parse_hex(value):
+    """Returns an ``(r, g, b)`` tuple for a ``#rrggbb`` string, or ``None`` if it is not one."""
+    match = HEX_RE.match((value or '').strip())
+    if not match:
+        return None
+    digits = match.group(1)
+    return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def nearby_bins(rgb, radius=COLOR_SEARCH_RADIUS):
+    """Returns ``(bin, closeness)`` pairs for every histogram bin whose centre lies within ``radius`` of ``rgb``."""
+    step = 256 // COLOR_LEVELS
+    centres = [i * step + step // 2 for i in range(COLOR_LEVELS)]
+    bins = []
+    for ri, r in enumerate(centres):
+        for gi, g in enumerate(centres):
+            for bi, b in enumerate(centres):
+                distance = math.dist(rgb, (r, g, b))
+                if distance <= radius:
+                    bins.append((ri * COLOR_LEVELS ** 2 + gi * COLOR_LEVELS + bi, 1 - distance / (radius * 2)))
+    return bins
+
+
+def index_image_colors(image_id, histogram):
+    """Replaces the indexed colour bins of an image with those of ``histogram``."""
+    from .models import ImageColor
+
+    with transaction.atomic():
+        ImageColor.objects.filter(image_id=image_id).delete()
+        ImageColor.objects.bulk_create([
+            ImageColor(image_id=image_id, bin=bin_, weight=weight)
+            for bin_, weight in histogram.items()
+        ])
+
+
+def filter_by_color(queryset, rgb, min_score=MIN_COLOR_SCORE):
+    """
+    Restricts ``queryset`` to images containing colours close to ``rgb`` and annotates each
+    with ``color_score``: the share of its pixels in nearby bins, weighted by closeness.
+    Only the indexed ``ImageColor`` rows are read, so no image is decoded at query time.
+    """
+    from .models import ImageColor
+
+    bins = nearby_bins(rgb)
+    closeness = Case(
+        *[When(bin=bin_, then=Value(weight)) for bin_, weight in bins],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    scores = (
+        ImageColor.objects.filter(bin__in=[bin_ for bin_, _ in bins])
+        .values('image_id')
+        .annotate(score=Sum(F('weight') * closeness))
+    )
+    matching = scores.filter(score__gte=min_score).values('image_id')
+    score = scores.filter(image_id=OuterRef('pk')).values('score')[:1]
+    return queryset.filter(id__in=matching).annotate(color_score=Subquery(score, output_field=FloatField()))
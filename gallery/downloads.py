@@ -0,0 +1,112 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_etags
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(size, modified):
+    """Returns a strong ETag for a stored file from its size and modification time."""
+    return f'"{size:x}-{int(modified.timestamp() * 1000):x}"'
+
+
+def parse_range(header, size):
+    """
+    Parses a single-range ``Range`` header into an inclusive ``(start, end)`` pair.
+    Returns ``None`` when the header is absent or not a valid single byte range, which
+    means the whole file should be served, and raises ``ValueError`` when the range is
+    well-formed but unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        # An inverted range is invalid rather than unsatisfiable, so the header is ignored.
+        return None
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # A suffix range ("bytes=-500") asks for the final N bytes.
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    return start, end
+
+
+def _stream(file, length):
+    try:
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _if_range_matches(request, etag):
+    if_range = request.headers.get('If-Range')
+    return not if_range or etag in parse_etags(if_range)
+
+
+def serve_file(request, field_file, filename):
+    """
+    Serves a stored file as an attachment without reading it into memory. Conditional and
+    single ``Range`` requests are answered directly; with ``DOWNLOAD_OFFLOAD`` set, the
+    transfer is handed to the front proxy through ``X-Accel-Redirect`` or ``X-Sendfile``.
+    """
+    storage, name = field_file.storage, field_file.name
+    size = storage.size(name)
+    modified = storage.get_modified_time(name)
+    etag = file_etag(size, modified)
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(modified.timestamp()))
+    if response is not None:
+        # A 304 must repeat the validators so caches can refresh their stored copy.
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified.timestamp())
+        return response
+
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    offload = getattr(settings, 'DOWNLOAD_OFFLOAD', None)
+    if offload == 'x-accel-redirect':
+        # nginx answers Range and conditional requests itself for internal redirects.
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.DOWNLOAD_ACCEL_REDIRECT_PREFIX + name
+    elif offload == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = storage.path(name)
+    else:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size) if _if_range_matches(request, etag) else None
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is None:
+            response = FileResponse(storage.open(name, 'rb'), content_type=content_type)
+            response.block_size = CHUNK_SIZE
+        else:
+            start, end = byte_range
+            file = storage.open(name, 'rb')
+            file.seek(start)
+            response = StreamingHttpResponse(_stream(file, end - start + 1), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified.timestamp())
+    response['Content-Disposition'] = content_disposition_header(True, os.path.basename(filename))
+    return response
@@ -0,0 +1,33 @@
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _cache_key(user_id):
+    return f'gallery:followed:{user_id}'
+
+
+def get_followed_ids(user_id):
+    """
+    Returns the sorted ids of the users followed by ``user_id`` as a compact int64 array.
+    The array is kept in the configured cache as raw bytes and dropped whenever one of the
+    user's Follow rows changes, so all processes see new follows on their next request.
+    """
+    from .models import Follow
+
+    key = _cache_key(user_id)
+    cached = cache.get(key)
+    if cached is not None:
+        ids = array('q')
+        ids.frombytes(cached)
+        return ids
+    ids = array('q', sorted(Follow.objects.filter(follower_id=user_id).values_list('followed_id', flat=True)))
+    cache.set(key, ids.tobytes(), getattr(settings, 'FOLLOW_CACHE_TIMEOUT', 3600))
+    return ids
+
+
+def invalidate_followed_ids(user_id):
+    """Drops the cached follow set of ``user_id`` once the current transaction commits."""
+    transaction.on_commit(lambda: cache.delete(_cache_key(user_id)))
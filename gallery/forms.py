@@ -1,5 +1,6 @@
 from django import forms 
-from .models import Image, Category, Tag, UserProfile, Comment, Report, Album
+from .models import Image, Category, Tag, UserProfile, Comment, Report, Album, add_image_to_album
+from .tagging import edit_image_tags, set_image_tags
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 import json
@@ -40,14 +41,9 @@ class ImageUploadForm(forms.ModelForm):
         album_id = self.cleaned_data.get('album').id if self.cleaned_data.get('album') else None
         if commit:
             instance.save()
-            for tag_name in tags.split(','):
-                tag_name = tag_name.strip()
-                if tag_name:
-                    tag, created = Tag.objects.get_or_create(name=tag_name)
-                    instance.tags.add(tag)
+            set_image_tags(instance, tags.split(','))
             if album_id:
                 add_image_to_album(user, instance, album_id)
-            instance.save()
         return instance
 
 class ImageUpdateForm(forms.ModelForm):
@@ -80,16 +76,8 @@ class ImageUpdateForm(forms.ModelForm):
         tags = self.cleaned_data['tags']
         tags_to_remove = self.cleaned_data['tags_to_remove']
         if commit:
-            instance.save()  # Save the instance first to ensure it has a primary key
-            existing_tags = instance.tags.all()
-            all_tags = tags.split(',') + [tag.name for tag in existing_tags]
-            instance.tags.clear()
-            for tag_name in all_tags:
-                tag_name = tag_name.strip()
-                if tag_name and tag_name not in tags_to_remove.split(','):
-                    tag, created = Tag.objects.get_or_create(name=tag_name)
-                    instance.tags.add(tag)
-            instance.save()  # Ensure the many-to-many relationship is saved
+            instance.save()
+            edit_image_tags(instance, add=tags.split(','), remove=tags_to_remove.split(','))
         return instance
 
 class UserRegistrationForm(UserCreationForm):
@@ -0,0 +1,170 @@
+import os
+from io import BytesIO
+
+import numpy as np
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage, ImageOps
+
+# Widths (in pixels) of the resized copies generated for every uploaded image.
+RENDITION_WIDTHS = (256, 512, 1024)
+
+# Output formats for renditions: key -> (PIL format, file extension, save options).
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+# -----------------------------------------------------------------------------
+# Attributes
+# -----------------------------------------------------------------------------
+
+def read_image_attributes(fp):
+    """Returns ``(width, height, format)`` from an image file's header without decoding the pixels."""
+    with PILImage.open(fp) as img:
+        return img.width, img.height, img.format
+
+
+# -----------------------------------------------------------------------------
+# Perceptual hashing
+# -----------------------------------------------------------------------------
+
+def dhash(img, hash_size=8):
+    """
+    Returns the 64-bit difference hash of a PIL image: one bit per pair of horizontally
+    adjacent pixels in a ``(hash_size + 1) x hash_size`` greyscale thumbnail.
+    """
+    pixels = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), PILImage.LANCZOS), dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def compute_dhash(fp):
+    """Opens an image file and returns its difference hash, decoding as little as possible."""
+    with PILImage.open(fp) as img:
+        img.draft('L', (64, 64))
+        return dhash(ImageOps.exif_transpose(img))
+
+
+def to_signed64(value):
+    """Maps an unsigned 64-bit hash onto the range of a signed BigIntegerField."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned64(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+# -----------------------------------------------------------------------------
+# Colour
+# -----------------------------------------------------------------------------
+
+# Levels per RGB channel in the colour histogram, giving COLOR_LEVELS ** 3 bins.
+COLOR_LEVELS = 4
+
+# Bins holding less than this fraction of the pixels are left out of the histogram.
+MIN_COLOR_WEIGHT = 0.02
+
+
+def color_bin(r, g, b):
+    """Returns the histogram bin of a colour; accepts ints or NumPy arrays of channel values."""
+    step = 256 // COLOR_LEVELS
+    return (r // step) * COLOR_LEVELS ** 2 + (g // step) * COLOR_LEVELS + (b // step)
+
+
+def color_descriptor(img, palette_size=5):
+    """
+    Returns ``(histogram, palette)`` for a PIL image, computed on a 64x64 copy.
+    ``histogram`` maps colour bins to the fraction of pixels falling in them and
+    ``palette`` lists the mean colour of the most populated bins as ``[hex, weight]``.
+    """
+    pixels = np.asarray(img.convert('RGB').resize((64, 64), PILImage.BILINEAR), dtype=np.int32).reshape(-1, 3)
+    bins = color_bin(pixels[:, 0], pixels[:, 1], pixels[:, 2])
+    counts = np.bincount(bins, minlength=COLOR_LEVELS ** 3)
+    weights = counts / len(bins)
+    sums = np.stack([np.bincount(bins, weights=pixels[:, channel], minlength=COLOR_LEVELS ** 3) for channel in range(3)], axis=1)
+    means = np.rint(sums / np.maximum(counts, 1)[:, None]).astype(int)
+
+    histogram = {int(b): round(float(weights[b]), 4) for b in np.flatnonzero(weights >= MIN_COLOR_WEIGHT)}
+    palette = [
+        ['#%02x%02x%02x' % tuple(means[b]), round(float(weights[b]), 4)]
+        for b in np.argsort(counts)[::-1][:palette_size] if counts[b]
+    ]
+    return histogram, palette
+
+
+def analyze_image(fp):
+    """Decodes a small copy of an image once and returns ``(dhash, histogram, palette)``."""
+    with PILImage.open(fp) as img:
+        img.draft('RGB', (128, 128))
+        img = ImageOps.exif_transpose(img)
+        return (dhash(img), *color_descriptor(img))
+
+
+# -----------------------------------------------------------------------------
+# Renditions
+# -----------------------------------------------------------------------------
+
+def rendition_name(original_name, width, fmt):
+    """Returns the storage name of a rendition, stored next to the original file."""
+    root, _ = os.path.splitext(original_name)
+    return f"{root}_{width}w.{RENDITION_FORMATS[fmt][1]}"
+
+
+def rendition_widths(original_width):
+    """Returns the rendition widths to generate for an image of the given width, never upscaling."""
+    widths = [width for width in RENDITION_WIDTHS if width < original_width]
+    if original_width <= RENDITION_WIDTHS[-1]:
+        widths.append(original_width)
+    return widths
+
+
+def _encode(img, fmt):
+    pil_format, _, options = RENDITION_FORMATS[fmt]
+    if fmt == 'jpeg' and img.mode != 'RGB':
+        img = img.convert('RGB')
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    buffer = BytesIO()
+    img.save(buffer, pil_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_renditions(field_file, force=False):
+    """
+    Creates the resized WebP and JPEG copies of an image file and returns the rendition map
+    ``{format: {width: name}}`` suitable for ``Image.renditions``.
+    """
+    storage = field_file.storage
+    renditions = {fmt: {} for fmt in RENDITION_FORMATS}
+    field_file.open('rb')
+    try:
+        with PILImage.open(field_file) as img:
+            # Let the JPEG decoder skip detail we are about to throw away anyway.
+            img.draft('RGB', (RENDITION_WIDTHS[-1], RENDITION_WIDTHS[-1]))
+            img = ImageOps.exif_transpose(img)
+            img.load()
+            # Work from the largest rendition down so each resize starts from a smaller source.
+            for width in sorted(rendition_widths(img.width), reverse=True):
+                height = max(1, round(img.height * width / img.width))
+                if (width, height) != img.size:
+                    img = img.resize((width, height), PILImage.LANCZOS)
+                for fmt in RENDITION_FORMATS:
+                    name = rendition_name(field_file.name, width, fmt)
+                    if force and storage.exists(name):
+                        storage.delete(name)
+                    if not storage.exists(name):
+                        name = storage.save(name, _encode(img, fmt))
+                    renditions[fmt][str(width)] = name
+    finally:
+        field_file.close()
+    return renditions
+
+
+def build_srcset(storage, renditions, fmt):
+    """Returns a ``srcset`` attribute value for one format of a rendition map."""
+    names = (renditions or {}).get(fmt) or {}
+    return ', '.join(
+        f"{storage.url(names[width])} {width}w"
+        for width in sorted(names, key=int)
+    )
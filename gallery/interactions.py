@@ -6,6 +6,8 @@ from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.utils.text import slugify
 
 from django.http import HttpResponse, JsonResponse
 
@@ -13,17 +15,19 @@ from gallery.models import *
 from gallery.forms import *
 
 from .utils import *
+from .albumorder import append_image, move, reorder
+from .downloads import serve_file
+from .moderation import moderate
 
 import json
+import os
 
 
 def download_image(request, image_id):
     image = get_object_or_404(Image, id=image_id)
-    # Implement your logic for downloading the image
-    # For example, serve the image file as a download
-    response = HttpResponse(image.image_file, content_type='application/force-download')
-    response['Content-Disposition'] = f'attachment; filename="{image.image_file.name}"'
-    return response
+    # Stored names are content hashes, so name the download after the image instead.
+    extension = os.path.splitext(image.image_file.name)[1]
+    return serve_file(request, image.image_file, f"{slugify(image.title) or 'image'}{extension}")
 
 @login_required
 def submit_comment(request, image_id):
@@ -87,7 +91,7 @@ def add_to_album(request, image_id):
 def add_image_to_album(user, image, album_id):
     """Adds an image to the specified album."""
     album = Album.objects.get(id=album_id, user=user)
-    album.images.add(image)
+    append_image(album, image)
 
 @csrf_exempt
 def save_image_order(request, album_id):
@@ -239,40 +243,84 @@ def add_to_album(request, image_id):
             return redirect('image_detail', image_id=image.id)
     return redirect('image_detail', image_id=image.id)
 
+@login_required
 @csrf_exempt
 def save_image_order(request, album_id):
     if request.method == 'POST':
-        data = json.loads(request.body)
-        order = data.get('order', [])
-        album = Album.objects.get(id=album_id)
-        for index, image_id in enumerate(order):
-            album_image = AlbumImage.objects.get(album=album, image_id=image_id)
-            album_image.order = index
-            album_image.save()
+        album = get_object_or_404(Album, id=album_id, user=request.user)
+        try:
+            order = [int(image_id) for image_id in json.loads(request.body).get('order', [])]
+        except (AttributeError, TypeError, ValueError):
+            return JsonResponse({'status': 'fail'}, status=400)
+        reorder(album.id, order)
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'fail'}, status=400)
 
+@login_required
+@require_POST
+def move_album_image(request, album_id):
+    """Moves one image after another, ``{"image_id": 3, "after": 7}``, or to the front when ``after`` is null."""
+    album = get_object_or_404(Album, id=album_id, user=request.user)
+    try:
+        data = json.loads(request.body)
+        after = data.get('after')
+        rank = move(album.id, int(data['image_id']), None if after is None else int(after))
+    except (AttributeError, KeyError, TypeError, ValueError, AlbumImage.DoesNotExist):
+        return JsonResponse({'success': False, 'error': 'Invalid parameters'}, status=400)
+    return JsonResponse({'success': True, 'order': rank})
+
 @staff_required
 def admin_approve_image(request, image_id):
     image = get_object_or_404(Image, id=image_id)
-    image.moderation_status = ModerationStatus.APPROVED
-    image.save()
+    moderate(request.user, 'approve', images=[image.id])
     return redirect('admin_pending_images')
 
 @staff_required
 def admin_resolve_report(request, report_id):
     report = get_object_or_404(Report, id=report_id)
-    report.status = 'RESOLVED'
-    report.save()
+    moderate(request.user, 'resolve', reports=[report.id])
     return redirect('admin_reported_images')
 
 @staff_required
 def admin_resolve_comment_report(request, report_id):
     report = get_object_or_404(Report, id=report_id)
-    report.status = 'RESOLVED'
-    report.save()
+    moderate(request.user, 'resolve', reports=[report.id])
     return redirect('admin_reported_comments')
 
+@staff_required
+@require_POST
+def admin_bulk_moderate(request):
+    """
+    Approves, rejects or resolves the selected images, comments, albums and reports in one
+    transaction. Takes the admin forms' checkboxes, or a JSON body such as
+    ``{"action": "approve", "images": [1, 2]}``, which is answered with the changed counts.
+    """
+    is_json = request.content_type == 'application/json'
+    try:
+        if is_json:
+            data = json.loads(request.body)
+            action, get_ids = data.get('action'), lambda kind: data.get(kind, [])
+        else:
+            action, get_ids = request.POST.get('action'), request.POST.getlist
+        ids = {kind: [int(pk) for pk in get_ids(kind)] for kind in ('images', 'comments', 'albums', 'reports')}
+        changed = moderate(request.user, action, **ids)
+    except (AttributeError, TypeError, ValueError):
+        if is_json:
+            return JsonResponse({'success': False, 'error': 'Invalid parameters'}, status=400)
+        messages.error(request, 'Invalid moderation request.')
+        changed = None
+
+    if is_json:
+        return JsonResponse({'success': True, 'changed': changed})
+    if changed is not None:
+        summary = ', '.join(f'{count} {kind}' for kind, count in changed.items() if count)
+        done = {'approve': 'Approved', 'reject': 'Rejected', 'resolve': 'Resolved'}[action]
+        messages.success(request, f"{done} {summary or 'nothing'}.")
+    next_url = request.POST.get('next')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        next_url = 'admin_page'
+    return redirect(next_url)
+
 @require_POST
 @csrf_exempt
 def set_cover_image(request):
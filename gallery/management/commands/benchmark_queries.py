@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from gallery.queryplans import check_plans, seed
+
+class Command(BaseCommand):
+    help = "Seed a large dataset, then EXPLAIN and time the main query of each view and check it uses its index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help='Number of images to seed.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query; the best time is reported.')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows instead of rolling them back.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {options['rows']} images on {connection.vendor}...")
+            fixture = seed(options['rows'])
+            results = check_plans(fixture, repeat=options['repeat'])
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        missed = 0
+        for plan, output, ok, ms in results:
+            style = self.style.SUCCESS if ok else self.style.ERROR
+            self.stdout.write(style(f"{'ok  ' if ok else 'MISS'} {plan.name:<20} {ms:8.2f} ms  {plan.index}"))
+            if not ok:
+                missed += 1
+                self.stdout.write(output)
+        if missed:
+            raise CommandError(f'{missed} queries do not use their index')
+        self.stdout.write(self.style.SUCCESS(f'All {len(results)} queries use their index'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from gallery.imaging import compute_dhash, to_signed64
+from gallery.models import Image
+
+class Command(BaseCommand):
+    help = 'Compute perceptual hashes for images that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of rows fetched and written per batch.')
+
+    def handle(self, *args, **options):
+        images = Image.objects.filter(phash__isnull=True).order_by('id')
+        last_id = updated = 0
+        while True:
+            rows = list(images.filter(id__gt=last_id).only('id', 'image_file')[:options['chunk_size']])
+            if not rows:
+                break
+            last_id = rows[-1].id
+            changed = []
+            for image in rows:
+                try:
+                    with image.image_file.open('rb') as f:
+                        image.phash = to_signed64(compute_dhash(f))
+                        image.phash_updated_at = now()
+                except (OSError, ValueError) as exc:
+                    self.stderr.write(f'Skipping image {image.id}: {exc}')
+                    continue
+                changed.append(image)
+            Image.objects.bulk_update(changed, ['phash', 'phash_updated_at'])
+            updated += len(changed)
+            self.stdout.write(f'Hashed {updated} images (last id {last_id})')
+        self.stdout.write(self.style.SUCCESS(f'Successfully computed perceptual hashes for {updated} images'))
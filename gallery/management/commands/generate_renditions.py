@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from gallery.models import Image
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail renditions for existing images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate renditions that already exist.')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Number of rows fetched per query.')
+
+    def handle(self, *args, **options):
+        images = Image.objects.only('id', 'image_file', 'renditions').order_by('id')
+        if not options['force']:
+            images = images.filter(renditions={})
+        count = 0
+        for image in images.iterator(chunk_size=options['chunk_size']):
+            try:
+                image.update_renditions(force=options['force'])
+            except (OSError, ValueError) as exc:
+                self.stderr.write(f'Skipping image {image.id}: {exc}')
+                continue
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Successfully generated renditions for {count} images'))
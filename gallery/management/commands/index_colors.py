@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from gallery.colors import index_image_colors
+from gallery.imaging import analyze_image
+from gallery.models import Image
+
+class Command(BaseCommand):
+    help = 'Extract dominant colours and rebuild the colour index for existing images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-index images that already have colours.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of rows fetched per batch.')
+
+    def handle(self, *args, **options):
+        images = Image.objects.order_by('id')
+        if not options['all']:
+            images = images.filter(dominant_colors=[])
+        last_id = indexed = 0
+        while True:
+            rows = list(images.filter(id__gt=last_id).only('id', 'image_file')[:options['chunk_size']])
+            if not rows:
+                break
+            last_id = rows[-1].id
+            changed = []
+            for image in rows:
+                try:
+                    with image.image_file.open('rb') as f:
+                        _, histogram, image.dominant_colors = analyze_image(f)
+                except (OSError, ValueError) as exc:
+                    self.stderr.write(f'Skipping image {image.id}: {exc}')
+                    continue
+                index_image_colors(image.id, histogram)
+                changed.append(image)
+            Image.objects.bulk_update(changed, ['dominant_colors'])
+            indexed += len(changed)
+            self.stdout.write(f'Indexed {indexed} images (last id {last_id})')
+        self.stdout.write(self.style.SUCCESS(f'Successfully indexed colours for {indexed} images'))
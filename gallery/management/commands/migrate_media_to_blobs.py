@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from gallery.models import Image, ImageVersion, blob_storage
+from gallery.storage import BLOB_PREFIX, retain_blob
+from gallery.tasks import enqueue
+
+class Command(BaseCommand):
+    help = 'Move existing image files into content-addressed storage'
+
+    def handle(self, *args, **options):
+        moved = 0
+        for model, field_name in ((Image, 'image_file'), (ImageVersion, 'file')):
+            rows = (
+                model.objects.exclude(**{f'{field_name}__startswith': BLOB_PREFIX + '/'})
+                .exclude(**{field_name: ''})
+                .values_list('id', field_name)
+            )
+            for pk, name in rows.iterator():
+                if not blob_storage.exists(name):
+                    self.stderr.write(f'Skipping {model.__name__} {pk}: {name} is missing')
+                    continue
+                with blob_storage.open(name, 'rb') as f:
+                    new_name = blob_storage.save(name, f)
+                with transaction.atomic():
+                    if model is Image:
+                        renditions = Image.objects.filter(pk=pk).values_list('renditions', flat=True).first() or {}
+                        Image.objects.filter(pk=pk).update(image_file=new_name, renditions={})
+                        enqueue('generate_image_renditions', image_id=pk)
+                    else:
+                        renditions = {}
+                        model.objects.filter(pk=pk).update(**{field_name: new_name})
+                    retain_blob(new_name, blob_storage.size(new_name))
+                blob_storage.delete(name)
+                for names in renditions.values():
+                    for rendition in names.values():
+                        blob_storage.delete(rendition)
+                moved += 1
+        self.stdout.write(self.style.SUCCESS(f'Successfully moved {moved} files into content-addressed storage'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from gallery.search import get_backend, rebuild_search_index
+
+class Command(BaseCommand):
+    help = 'Drop and rebuild the full-text search index of all images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of images indexed per batch.')
+
+    def handle(self, *args, **options):
+        if get_backend() is None:
+            self.stderr.write('The database backend has no full-text search index; searches use icontains instead.')
+            return
+        indexed = rebuild_search_index(
+            chunk_size=options['chunk_size'],
+            progress=lambda count, last_id: self.stdout.write(f'Indexed {count} images (last id {last_id})'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt the search index with {indexed} images'))
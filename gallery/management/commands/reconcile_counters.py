@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from gallery.models import reconcile_counters
+
+class Command(BaseCommand):
+    help = 'Recount likes, favourites and comments and repair any drifted counters on images and albums'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted rows without fixing them.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of rows updated per batch.')
+
+    def handle(self, *args, **options):
+        drifted = reconcile_counters(dry_run=options['dry_run'], chunk_size=options['chunk_size'])
+        for row, changes in drifted:
+            summary = ', '.join(f'{field} {stored} -> {actual}' for field, (stored, actual) in changes.items())
+            self.stdout.write(f'{type(row).__name__} {row.id}: {summary}')
+
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(drifted)} rows with drifted counters'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from gallery.models import Album, Image, audience_expression
+
+class Command(BaseCommand):
+    help = 'Recompute the stored audience of every image and album from its privacy and moderation status'
+
+    def handle(self, *args, **options):
+        for model in (Image, Album):
+            expression = audience_expression()
+            # Only rows whose stored audience is out of date are rewritten.
+            updated = model.objects.alias(expected=expression).exclude(audience=F('expected')).update(audience=expression)
+            self.stdout.write(f'{model.__name__}: {updated} rows updated')
+        self.stdout.write(self.style.SUCCESS('Successfully refreshed audiences'))
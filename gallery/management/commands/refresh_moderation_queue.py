@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from gallery.moderation import rebuild_queue
+
+class Command(BaseCommand):
+    help = 'Rebuild the moderation queue and its report aggregates from the open reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of reported items aggregated per batch.')
+
+    def handle(self, *args, **options):
+        queued = rebuild_queue(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt the moderation queue with {queued} items'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from gallery.albumorder import renumber
+from gallery.models import Album
+
+class Command(BaseCommand):
+    help = 'Spread the image ranks of every album apart so that moves update a single row'
+
+    def handle(self, *args, **options):
+        changed = 0
+        for album_id in list(Album.objects.filter(albumimage__isnull=False).distinct().values_list('id', flat=True)):
+            changed += renumber(album_id)
+        self.stdout.write(self.style.SUCCESS(f'Successfully renumbered {changed} album images'))
@@ -0,0 +1,45 @@
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from gallery.tasks import PERIODIC_TASKS, schedule, work
+
+class Command(BaseCommand):
+    help = 'Process queued background tasks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=getattr(settings, 'TASK_WORKER_PROCESSES', 2), help='Number of worker processes.')
+        parser.add_argument('--batch-size', type=int, default=10, help='Number of tasks each worker claims at a time.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        worker_options = {
+            'batch_size': options['batch_size'],
+            'poll_interval': options['poll_interval'],
+            'once': options['once'],
+        }
+        for name in PERIODIC_TASKS:
+            schedule(name)
+        processes = max(1, options['processes'])
+        self.stdout.write(f'Starting {processes} worker process(es)')
+        if processes == 1:
+            try:
+                work(**worker_options)
+            except KeyboardInterrupt:
+                pass
+            return
+
+        # Children must open their own database connections rather than share the parent's.
+        connections.close_all()
+        workers = [multiprocessing.Process(target=work, kwargs=worker_options, daemon=True) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
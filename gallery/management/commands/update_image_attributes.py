@@ -1,16 +1,89 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 from django.core.management.base import BaseCommand
+from django.db.models import Q
+from gallery.imaging import read_image_attributes
 from gallery.models import Image
-from PIL import Image as PILImage
+
+ATTRIBUTE_FIELDS = ['width', 'height', 'format', 'size']
+
+
+def inspect_image(row):
+    """
+    Reads the attributes of one image file in a worker process. Returns ``None`` when the
+    stored attributes are complete and the file size on disk still matches them.
+    """
+    image_id, path, width, height, img_format, size = row
+    try:
+        file_size = os.path.getsize(path)
+        if None not in (width, height, img_format) and size == file_size:
+            return None
+        width, height, img_format = read_image_attributes(path)
+    except (OSError, ValueError) as exc:
+        return image_id, None, str(exc)
+    return image_id, (width, height, img_format, file_size), None
+
 
 class Command(BaseCommand):
     help = 'Update image attributes for existing records'
 
-    def handle(self, *args, **kwargs):
-        images = Image.objects.all()
-        for image in images:
-            with PILImage.open(image.image_file.path) as img:
-                image.width, image.height = img.size
-                image.format = img.format
-            image.size = image.image_file.size
-            image.save()
-        self.stdout.write(self.style.SUCCESS('Successfully updated image attributes for existing records'))
\ No newline at end of file
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of rows fetched and written per batch.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes reading image headers.')
+        parser.add_argument('--missing-only', action='store_true', help='Skip the stale check and only visit rows with missing attributes.')
+        parser.add_argument('--start-after', type=int, default=0, help='Resume after this image id.')
+        parser.add_argument('--checkpoint', help='File recording the last processed id, used to resume an interrupted run.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        checkpoint = options['checkpoint']
+        last_id = options['start_after']
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                last_id = max(last_id, int(f.read().strip() or 0))
+            self.stdout.write(f'Resuming after image {last_id}')
+
+        images = Image.objects.order_by('id')
+        if options['missing_only']:
+            images = images.filter(
+                Q(width__isnull=True) | Q(height__isnull=True) | Q(format__isnull=True) | Q(size__isnull=True)
+            )
+        total = images.filter(id__gt=last_id).count()
+        storage = Image._meta.get_field('image_file').storage
+
+        workers = max(1, options['workers'])
+        scanned = updated = failed = 0
+        # Workers only read files; the database is queried and written by this process alone.
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                rows = list(
+                    images.filter(id__gt=last_id)
+                    .values_list('id', 'image_file', *ATTRIBUTE_FIELDS)[:chunk_size]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                jobs = [(row[0], storage.path(row[1])) + row[2:] for row in rows if row[1]]
+                changed = []
+                for result in pool.map(inspect_image, jobs, chunksize=max(1, len(jobs) // (4 * workers))):
+                    if result is None:
+                        continue
+                    image_id, attributes, error = result
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'Image {image_id}: {error}')
+                        continue
+                    changed.append(Image(id=image_id, **dict(zip(ATTRIBUTE_FIELDS, attributes))))
+                Image.objects.bulk_update(changed, ATTRIBUTE_FIELDS)
+
+                scanned += len(rows)
+                updated += len(changed)
+                if checkpoint:
+                    with open(checkpoint, 'w') as f:
+                        f.write(str(last_id))
+                self.stdout.write(f'Scanned {scanned}/{total}, updated {updated}, failed {failed} (last id {last_id})')
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(f'Successfully updated attributes for {updated} images'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from gallery.trending import update_trending_scores
+
+class Command(BaseCommand):
+    help = 'Recompute the time-decayed trending scores of all images and albums'
+
+    def handle(self, *args, **options):
+        written = update_trending_scores()
+        summary = ', '.join(f'{count} {name.lower()} rows' for name, count in written.items())
+        self.stdout.write(self.style.SUCCESS(f'Updated trending scores: {summary}'))
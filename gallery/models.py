@@ -6,28 +6,50 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.http import Http404
 from akismet import Akismet
-from django.db.models import Q
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Lower
 from django.core.paginator import Paginator
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 import json
-from PIL import Image as PILImage
 
+from .albumorder import append_image
+from .autocomplete import tag_deleted, tag_saved, tag_usage_changed
+from .follows import get_followed_ids, invalidate_followed_ids
+from .imaging import build_srcset, generate_renditions
+from .moderation import refresh_queue
+from .pagecache import album_changed, bump, image_changed, tags_changed
+from .search import index_images, search, unindex_images
+from .storage import ContentAddressedStorage, release_blob, retain_blob
+from .tasks import enqueue
+from .visibility import VisibilityChecker
 
 
 
+
+def privacy_filter(user):
+    """
+    Returns the Q object selecting approved content visible to a non-staff ``user``.
+    Anonymous and member visibility is a range over the stored ``audience`` column; only
+    followers-only and private content is checked per viewer, against the cached follow
+    graph, so the query needs no join through Follow and no ``distinct()``.
+    """
+    if not user.is_authenticated:
+        return Q(audience=Audience.PUBLIC)
+    return Q(audience__lte=Audience.MEMBERS) | Q(audience=Audience.RESTRICTED) & (
+        Q(privacy="followers", user_id__in=list(get_followed_ids(user.pk))) |
+        Q(privacy="private", user=user)
+    )
+
+
 class CustomImageManager(models.Manager):
     def get_filtered_images(self, user):
         """Filters images based on privacy settings."""
-        
-        # Start by getting all images with related follower information
-        images = self.all().prefetch_related(
-            models.Prefetch('user__followers', queryset=Follow.objects.all())
-        )
-        
+        images = self.all()
+
         # If user is staff, show all images
         if user.is_staff:
             return images
@@ -37,26 +59,13 @@ class CustomImageManager(models.Manager):
             reported_images = Report.objects.filter(reported_by=user).values_list('image_id', flat=True)
             images = images.exclude(id__in=reported_images)
 
-        # If user is authenticated but not staff, filter based on privacy settings
-        if user.is_authenticated:
-            return images.filter(
-                Q(privacy="public", moderation_status=ModerationStatus.APPROVED) |
-                Q(privacy="users", moderation_status=ModerationStatus.APPROVED) |
-                Q(privacy="followers", user__followers__follower=user, moderation_status=ModerationStatus.APPROVED) |
-                Q(privacy="private", user=user, moderation_status=ModerationStatus.APPROVED)
-            ).distinct()
-        else:
-            return images.filter(privacy="public", moderation_status=ModerationStatus.APPROVED).distinct()
+        return images.filter(privacy_filter(user))
 
 class CustomAlbumManager(models.Manager):
     def get_filtered_albums(self, user):
         """Filters albums based on privacy settings."""
-        
-        # Start by getting all albums with related follower information
-        albums = self.all().prefetch_related(
-            models.Prefetch('user__followers', queryset=Follow.objects.all())
-        )
-        
+        albums = self.all()
+
         # If user is staff, show all albums
         if user.is_staff:
             return albums
@@ -66,16 +75,7 @@ class CustomAlbumManager(models.Manager):
             # reported_albums = Report.objects.filter(reported_by=user).values_list('album_id', flat=True)
             # albums = albums.exclude(id__in=reported_albums)
 
-        # If user is authenticated but not staff, filter based on privacy settings
-        if user.is_authenticated:
-            return albums.filter(
-                Q(privacy="public", moderation_status=ModerationStatus.APPROVED) |
-                Q(privacy="users", moderation_status=ModerationStatus.APPROVED) |
-                Q(privacy="followers", user__followers__follower=user, moderation_status=ModerationStatus.APPROVED) |
-                Q(privacy="private", user=user, moderation_status=ModerationStatus.APPROVED)
-            ).distinct()
-        else:
-            return albums.filter(privacy="public", moderation_status=ModerationStatus.APPROVED).distinct()
+        return albums.filter(privacy_filter(user))
 
 # ----------------------------------------------------------------------------- 
 # Helper Functions
@@ -92,24 +92,13 @@ def report_image(user, image, report_type, description=""):
 
 
 def get_image_visibility(user, image):
-    """Check if the user can view the image based on privacy settings."""
-    if image.privacy == 'private' and image.user != user:
-        raise PermissionDenied("You do not have permission to view this image.")
-    elif image.privacy == 'followers' and not Follow.objects.filter(follower=user, followed=image.user).exists():
-        raise PermissionDenied("You do not have permission to view this image.")
-    elif image.privacy == 'users' and not user.is_authenticated:
-        raise PermissionDenied("You do not have permission to view this image.")
-    return True
+    """Check if the user can view the image based on privacy settings and moderation status."""
+    return VisibilityChecker(user).require(image)
 
 
 def search_images(query, user=None):
-    """Search for images based on title, description, tags, or categories."""
-    return Image.objects.get_filtered_images(user).filter(
-        Q(title__icontains=query) |
-        Q(description__icontains=query) |
-        Q(tags__name__icontains=query) |
-        Q(category__name__icontains=query)
-    ).distinct()
+    """Search for images by title, description, tags or category, annotated with a ``search_rank``."""
+    return search(Image.objects.get_filtered_images(user), query)
 
 
 def check_spam(content):
@@ -122,6 +111,8 @@ def check_spam(content):
 # Models
 # -----------------------------------------------------------------------------
 
+blob_storage = ContentAddressedStorage()
+
 class ModerationStatus(models.TextChoices):
     """Enumeration of possible moderation statuses for images and comments."""
     PENDING = 'PENDING', 'Pending'
@@ -129,6 +120,68 @@ class ModerationStatus(models.TextChoices):
     REJECTED = 'REJECTED', 'Rejected'
 
 
+class Audience(models.IntegerChoices):
+    """Widest class of viewers an image or album is shown to, derived from its privacy and moderation status."""
+    PUBLIC = 0, 'Everyone'
+    MEMBERS = 1, 'Site members'
+    RESTRICTED = 2, 'Followers or owner'
+    HIDDEN = 3, 'Staff and owner'
+
+
+def audience_for(privacy, moderation_status):
+    """Returns the audience stored for the given privacy setting and moderation status."""
+    if moderation_status != ModerationStatus.APPROVED:
+        return Audience.HIDDEN
+    return {'public': Audience.PUBLIC, 'users': Audience.MEMBERS}.get(privacy, Audience.RESTRICTED)
+
+
+def audience_expression():
+    """SQL form of ``audience_for``, for recomputing the column in a single UPDATE."""
+    return models.Case(
+        models.When(~Q(moderation_status=ModerationStatus.APPROVED), then=models.Value(Audience.HIDDEN)),
+        models.When(privacy='public', then=models.Value(Audience.PUBLIC)),
+        models.When(privacy='users', then=models.Value(Audience.MEMBERS)),
+        default=models.Value(Audience.RESTRICTED),
+    )
+
+
+class TaskStatus(models.TextChoices):
+    """Enumeration of possible states for queued background tasks."""
+    PENDING = 'PENDING', 'Pending'
+    RUNNING = 'RUNNING', 'Running'
+    FAILED = 'FAILED', 'Failed'
+
+
+class Task(models.Model):
+    """A background job queued by ``gallery.tasks.enqueue`` and processed by ``run_workers``."""
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=TaskStatus.choices, default=TaskStatus.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class MediaBlob(models.Model):
+    """A content-addressed media file, shared by every Image and ImageVersion with the same bytes."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveIntegerField(null=True, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+
 class SiteSettings(models.Model):
     """Global settings for site-wide features such as moderation."""
     moderation_enabled = models.BooleanField(default=True)
@@ -168,6 +221,9 @@ class UserActivity(models.Model):
     target_comment = models.ForeignKey('Comment', on_delete=models.CASCADE, null=True, blank=True)
     target_user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="activity_target")
 
+    class Meta:
+        indexes = [models.Index(fields=['user', '-timestamp'], name='activity_user_recent_idx')]
+
     def __str__(self):
         return f"{self.user.username} performed {self.action}"
 
@@ -189,22 +245,54 @@ class Tag(models.Model):
         default=ModerationStatus.PENDING,
     )
 
+    class Meta:
+        # Tags are matched case-insensitively, see gallery.tagging.
+        constraints = [models.UniqueConstraint(Lower('name'), name='tag_name_lower_uniq')]
+
     def __str__(self):
         return self.name
 
 
+def fields_to_save(instance, excluded):
+    """
+    The fields a full save of ``instance`` writes: every loaded concrete field except
+    ``excluded``, the columns other code keeps current with UPDATEs.
+    """
+    deferred = instance.get_deferred_fields()
+    return [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in excluded and field.attname not in deferred
+    ]
+
+
+def reload_expressions(instance, fields):
+    """Drops the expressions a save wrote to ``fields`` so they are read back from the row on first access."""
+    for field in fields:
+        if hasattr(instance.__dict__.get(field), 'resolve_expression'):
+            del instance.__dict__[field]
+
+
 class Image(models.Model):
     """Represents an image uploaded by a user, with features like title, description, tags, and categories."""
+    COUNTER_FIELDS = ['like_count', 'favorite_count', 'comment_count']
+    # Maintained with F() and bulk UPDATEs, so a full save never writes back the copies it holds.
+    UPDATED_IN_PLACE = ['views', 'trending_score', *COUNTER_FIELDS]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='images')
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
-    image_file = models.ImageField(upload_to='images/')
+    image_file = models.ImageField(upload_to='images/', storage=blob_storage)
     uploaded_at = models.DateTimeField(default=now)
     views = models.PositiveIntegerField(default=0)
     is_public = models.BooleanField(default=True)
     category = models.ForeignKey(Category, related_name='images', on_delete=models.CASCADE, blank=True, null=True)
     tags = models.ManyToManyField(Tag, related_name='images', blank=True)
     popularity_score = models.FloatField(default=0.0)
+    trending_score = models.FloatField(default=0.0, editable=False)  # time-decayed, see gallery.trending
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    card_version = models.PositiveIntegerField(default=0, editable=False)  # bumped whenever the cached gallery card goes stale
     objects = CustomImageManager()
     privacy = models.CharField(max_length=20, choices=[('public', 'Public'), ('users', 'Site Members Only'), ('followers', 'Followers Only'), ('private', 'Private')], default='public')
 
@@ -212,34 +300,94 @@ class Image(models.Model):
     height = models.PositiveIntegerField(editable=False, null=True)
     format = models.CharField(max_length=10, editable=False, null=True)
     size = models.PositiveIntegerField(editable=False, null=True)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    phash = models.BigIntegerField(editable=False, null=True, blank=True)  # 64-bit difference hash, see gallery.similarity
+    phash_updated_at = models.DateTimeField(editable=False, null=True, blank=True)  # lets the similarity index catch up
+    dominant_colors = models.JSONField(default=list, blank=True, editable=False)  # [[hex, weight], ...], see gallery.colors
 
     moderation_status = models.CharField(max_length=10, choices=ModerationStatus.choices, default=ModerationStatus.PENDING)
     moderation_updated_at = models.DateTimeField(null=True, blank=True)
+    audience = models.PositiveSmallIntegerField(choices=Audience.choices, default=Audience.HIDDEN, editable=False)
     moderated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="moderated_images", limit_choices_to={'is_staff': True})
 
     alt_text = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-like_count', '-id'], name='image_like_count_idx'),
+            models.Index(fields=['-favorite_count', '-id'], name='image_favorite_count_idx'),
+            models.Index(fields=['-trending_score', '-id'], name='image_trending_idx'),
+            models.Index(fields=['audience', '-uploaded_at', '-id'], name='image_audience_newest_idx'),
+            models.Index(fields=['user', '-uploaded_at', '-id'], name='image_user_newest_idx'),
+            models.Index(fields=['phash_updated_at'], name='image_phash_updated_idx'),
+            # Only the moderation queue reads pending images, and they are a small share of the table.
+            models.Index(fields=['uploaded_at'], name='image_pending_idx', condition=Q(moderation_status=ModerationStatus.PENDING)),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored file so a replaced upload can release its blob.
+        instance._stored_file_name = instance.__dict__.get('image_file')
+        # Remember the stored audience so pages that listed the image are invalidated when it changes.
+        instance._stored_audience = instance.__dict__.get('audience')
+        return instance
+
     def save(self, *args, **kwargs):
-        if self.pk:
-            self.popularity_score = self.calculate_popularity_score()
+        if not self._state.adding:
+            # Computed by the UPDATE itself, from the row's current views and counters.
+            self.popularity_score = (F('like_count') * 2) + F('views')
+            self.card_version = F('card_version') + 1
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = fields_to_save(self, Image.UPDATED_IN_PLACE)
         if self.moderation_status != ModerationStatus.PENDING:
             self.moderation_updated_at = now()
-        if not self.pk:  # Only calculate attributes for new images
-            with PILImage.open(self.image_file) as img:
-                self.width, self.height = img.size
-                self.format = img.format
+        self.audience = audience_for(self.privacy, self.moderation_status)
+        file_changed = not self.image_file._committed
+        if file_changed:
             self.size = self.image_file.size
+            # Saving replaces the field file with one read back from storage; keep the upload itself.
+            upload = self.image_file.file
         super().save(*args, **kwargs)
+        reload_expressions(self, ['popularity_score', 'card_version'])
+        if file_changed:
+            retain_blob(self.image_file.name, self.size, self.image_file.storage, upload)
+            old_name = getattr(self, '_stored_file_name', None)
+            if old_name and old_name != self.image_file.name:
+                release_blob(self.image_file.storage, old_name, self.renditions)
+            self._stored_file_name = self.image_file.name
+            # Decoding the upload is left to the task workers so the request only pays for writing the file.
+            enqueue('extract_image_metadata', image_id=self.pk)
+            enqueue('generate_image_renditions', image_id=self.pk)
 
     def calculate_popularity_score(self):
         """Calculates the popularity score based on likes and views."""
-        likes_count = self.liked_by.count()
-        return (likes_count * 2) + self.views
+        return (self.like_count * 2) + self.views
+
+    def update_renditions(self, force=False):
+        """Generates the resized copies of the image file and stores their names."""
+        self.renditions = generate_renditions(self.image_file, force=force)
+        Image.objects.filter(pk=self.pk).update(renditions=self.renditions, card_version=F('card_version') + 1)
+
+    def srcset(self, fmt='jpeg'):
+        """Returns the ``srcset`` value for the renditions of the given format."""
+        return build_srcset(self.image_file.storage, self.renditions, fmt)
 
     def __str__(self):
         return self.title
 
 
+class ImageColor(models.Model):
+    """One colour-histogram bin of an image, indexed so images can be searched by colour."""
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="colors")
+    bin = models.PositiveSmallIntegerField()
+    weight = models.FloatField()
+
+    class Meta:
+        unique_together = ('image', 'bin')
+        indexes = [models.Index(fields=['bin', 'weight'])]
+
+
 class Comment(models.Model):
     """Represents a comment made by a user on an image."""
     image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="comments")
@@ -252,9 +400,15 @@ class Comment(models.Model):
     moderated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="moderated_comments")
 
     def save(self, *args, **kwargs):
+        is_new = self.pk is None
         if self.moderation_status != ModerationStatus.PENDING:
             self.moderation_updated_at = now()
         super().save(*args, **kwargs)
+        if is_new and getattr(settings, 'AKISMET_API_KEY', None):
+            enqueue('check_comment_spam', comment_id=self.pk)
+
+    class Meta:
+        indexes = [models.Index(fields=['image', '-created_at'], name='comment_image_newest_idx')]
 
     def __str__(self):
         return f"Comment by {self.user.username} on {self.image.title}"
@@ -285,18 +439,39 @@ class Favorite(models.Model):
 
 class Album(models.Model):
     """Represents an album to organize images for a user."""
+    COUNTER_FIELDS = ['like_count', 'favorite_count']
+    UPDATED_IN_PLACE = ['views', 'trending_score', *COUNTER_FIELDS]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="albums")
     name = models.CharField(max_length=100)
     images = models.ManyToManyField(Image, related_name="albums", through="AlbumImage")
     cover_image = models.ForeignKey(Image, on_delete=models.SET_NULL, null=True, blank=True, related_name='cover_for_albums')
     created_at = models.DateTimeField(auto_now_add=True)
     views = models.PositiveIntegerField(default=0)
+    trending_score = models.FloatField(default=0.0, editable=False)  # time-decayed, see gallery.trending
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
     privacy = models.CharField(max_length=10, choices=[('public', 'Public'), ('users', 'Site Members Only'), ('followers', 'Followers Only'), ('private', 'Private')], default='public')
     moderation_status = models.CharField(max_length=10, choices=ModerationStatus.choices, default=ModerationStatus.PENDING)
     moderation_updated_at = models.DateTimeField(null=True, blank=True)
+    audience = models.PositiveSmallIntegerField(choices=Audience.choices, default=Audience.HIDDEN, editable=False)
     moderated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="moderated_albums")
     objects = CustomAlbumManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-like_count', '-id'], name='album_like_count_idx'),
+            models.Index(fields=['-favorite_count', '-id'], name='album_favorite_count_idx'),
+            models.Index(fields=['-trending_score', '-id'], name='album_trending_idx'),
+            models.Index(fields=['audience', '-created_at', '-id'], name='album_audience_newest_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_audience = instance.__dict__.get('audience')
+        return instance
+
     def __str__(self):
         return self.name
 
@@ -305,16 +480,16 @@ class Album(models.Model):
             self.cover_image = self.images.first()
 
     def save(self, *args, **kwargs):
-        if self.pk:
-            self.popularity_score = self.calculate_popularity_score()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = fields_to_save(self, Album.UPDATED_IN_PLACE)
         if self.moderation_status != ModerationStatus.PENDING:
             self.moderation_updated_at = now()
+        self.audience = audience_for(self.privacy, self.moderation_status)
         super().save(*args, **kwargs)
 
     def calculate_popularity_score(self):
         """Calculates the popularity score based on likes and views."""
-        likes_count = self.liked_by.count()
-        return (likes_count * 2) + self.views
+        return (self.like_count * 2) + self.views
 
     @classmethod
     def get_or_create_favorites_album(cls, user):
@@ -327,11 +502,14 @@ class AlbumImage(models.Model):
     """Represents a relationship between an album and an image."""
     album = models.ForeignKey(Album, on_delete=models.CASCADE)
     image = models.ForeignKey(Image, on_delete=models.CASCADE)
-    order = models.PositiveIntegerField(default=0)
+    order = models.PositiveIntegerField(default=0)  # sparse rank, see gallery.albumorder
 
     class Meta:
         unique_together = ('album', 'image')
         ordering = ['order']
+        indexes = [
+            models.Index(fields=['album', 'order'], name='album_image_order_idx'),
+        ]
 
 @receiver(post_save, sender=AlbumImage)
 def set_album_cover_image(sender, instance, created, **kwargs):
@@ -349,6 +527,11 @@ class Follow(models.Model):
     class Meta:
         unique_together = ('follower', 'followed')
 
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_cache(sender, instance, **kwargs):
+    invalidate_followed_ids(instance.follower_id)
+
 
 class Report(models.Model):
     """
@@ -372,9 +555,42 @@ class Report(models.Model):
     status = models.CharField(max_length=10, choices=REPORT_STATUS_CHOICES, default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Open reports are what the admin pages join on; resolved ones accumulate and are rarely read.
+        indexes = [
+            models.Index(fields=['image'], name='report_pending_image_idx', condition=Q(status='PENDING', image__isnull=False)),
+            models.Index(fields=['comment'], name='report_pending_comment_idx', condition=Q(status='PENDING', comment__isnull=False)),
+        ]
+
     def __str__(self):
         return f"Report by {self.reported_by.username} on {'image' if self.image else 'comment'}"
 
+
+class ModerationQueueItem(models.Model):
+    """
+    The open reports against one image or comment, aggregated so the moderation queue is
+    read and ordered without joining or grouping reports. Kept current by
+    ``gallery.moderation.refresh_queue`` whenever a report is written, resolved or deleted.
+    """
+    image = models.OneToOneField(Image, on_delete=models.CASCADE, null=True, blank=True, related_name="queue_item")
+    comment = models.OneToOneField(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name="queue_item")
+    open_reports = models.PositiveIntegerField(default=0)
+    spam_reports = models.PositiveIntegerField(default=0)
+    abuse_reports = models.PositiveIntegerField(default=0)
+    other_reports = models.PositiveIntegerField(default=0)
+    first_reported_at = models.DateTimeField()
+    last_reported_at = models.DateTimeField()
+    priority = models.FloatField(default=0.0)  # see gallery.moderation.REPORT_WEIGHTS
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-priority', '-last_reported_at', '-id'], name='queue_image_priority_idx', condition=Q(image__isnull=False)),
+            models.Index(fields=['-priority', '-last_reported_at', '-id'], name='queue_comment_priority_idx', condition=Q(comment__isnull=False)),
+        ]
+
+    def __str__(self):
+        return f"{self.open_reports} open reports on {'image' if self.image_id else 'comment'}"
+
 class AlbumLike(models.Model):
     """Represents a like on an album by a user."""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="album_likes")
@@ -396,6 +612,185 @@ class AlbumFavorite(models.Model):
     def __str__(self):
         return f"{self.user.username} favorites {self.album.name}"
 
+# ----------------------------------------------------------------------------- 
+# Counters
+# -----------------------------------------------------------------------------
+
+# Rows counted on Image and Album: model -> (counted model, foreign key attribute, counter field).
+COUNTED_RELATIONS = {
+    Like: (Image, 'image_id', 'like_count'),
+    Favorite: (Image, 'image_id', 'favorite_count'),
+    Comment: (Image, 'image_id', 'comment_count'),
+    AlbumLike: (Album, 'album_id', 'like_count'),
+    AlbumFavorite: (Album, 'album_id', 'favorite_count'),
+}
+
+
+def adjust_counter(sender, instance, delta):
+    """Moves the counter tracking ``instance`` by ``delta`` in a single atomic UPDATE."""
+    model, attname, field = COUNTED_RELATIONS[sender]
+    rows = model.objects.filter(pk=getattr(instance, attname))
+    if delta < 0:
+        # A counter that has not been filled in yet stays at 0 rather than going negative.
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**{field: F(field) + delta})
+
+
+def reconcile_counters(dry_run=False, chunk_size=1000):
+    """
+    Recounts likes, favourites and comments and rewrites the counters that drifted from
+    them, unless ``dry_run`` is set. Returns ``(row, {field: (stored, actual)})`` for each
+    drifted row.
+    """
+    counters = {}
+    for source, (model, attname, field) in COUNTED_RELATIONS.items():
+        actual = (
+            source.objects.filter(**{attname: OuterRef('pk')})
+            .order_by().values(attname).annotate(n=Count('pk')).values('n')
+        )
+        counters.setdefault(model, {})[field] = Coalesce(Subquery(actual, output_field=IntegerField()), 0)
+
+    drifted_rows = []
+    for model, fields in counters.items():
+        annotations = {f'actual_{field}': expression for field, expression in fields.items()}
+        drifted = Q()
+        for field in fields:
+            drifted |= ~Q(**{field: F(f'actual_{field}')})
+        rows = list(model.objects.annotate(**annotations).filter(drifted).only('id', *fields))
+        for row in rows:
+            changes = {
+                field: (getattr(row, field), getattr(row, f'actual_{field}'))
+                for field in fields if getattr(row, field) != getattr(row, f'actual_{field}')
+            }
+            for field in fields:
+                setattr(row, field, getattr(row, f'actual_{field}'))
+            drifted_rows.append((row, changes))
+        if rows and not dry_run:
+            model.objects.bulk_update(rows, list(fields), batch_size=chunk_size)
+    return drifted_rows
+
+
+def increment_counter(sender, instance, created, **kwargs):
+    if created:
+        adjust_counter(sender, instance, 1)
+
+
+def decrement_counter(sender, instance, **kwargs):
+    adjust_counter(sender, instance, -1)
+
+
+for counted in COUNTED_RELATIONS:
+    post_save.connect(increment_counter, sender=counted)
+    post_delete.connect(decrement_counter, sender=counted)
+
+# ----------------------------------------------------------------------------- 
+# Search and Tag Indexes
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=Image)
+def index_saved_image(sender, instance, **kwargs):
+    index_images([instance.pk])
+
+
+@receiver(post_delete, sender=Image)
+def unindex_deleted_image(sender, instance, **kwargs):
+    unindex_images([instance.pk])
+
+
+@receiver(m2m_changed, sender=Image.tags.through)
+def index_retagged_images(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The cleared rows are unknown once post_clear fires.
+        related = instance.images if reverse else instance.tags
+        instance._cleared_ids = set(related.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_clear':
+            pk_set = getattr(instance, '_cleared_ids', set())
+        delta = -1 if action != 'post_add' else 1
+        if not reverse:
+            index_images([instance.pk])
+            tag_usage_changed({tag_id: delta for tag_id in pk_set})
+        else:
+            index_images(pk_set)
+            tag_usage_changed({instance.pk: delta * len(pk_set)})
+
+
+@receiver(post_save, sender=Tag)
+def index_renamed_tag(sender, instance, created, **kwargs):
+    if not created:
+        index_images(instance.images.values_list('id', flat=True))
+    tag_saved(instance, created)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_images(sender, instance, **kwargs):
+    instance._tagged_image_ids = list(instance.images.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def index_untagged_images(sender, instance, **kwargs):
+    index_images(getattr(instance, '_tagged_image_ids', []))
+    tag_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_renamed_category(sender, instance, created, **kwargs):
+    if not created:
+        index_images(instance.images.values_list('id', flat=True))
+
+# ----------------------------------------------------------------------------- 
+# Page Cache Invalidation
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=Image)
+def invalidate_image_pages(sender, instance, **kwargs):
+    image_changed(instance, was_public=getattr(instance, '_stored_audience', None) == Audience.PUBLIC)
+    instance._stored_audience = instance.audience
+
+
+@receiver(pre_delete, sender=Image)
+def invalidate_deleted_image_pages(sender, instance, **kwargs):
+    # The image's tags are still readable before the delete cascades.
+    image_changed(instance)
+
+
+@receiver(m2m_changed, sender=Image.tags.through)
+def invalidate_retagged_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        bump(f'tag:{instance.pk}')
+    elif instance.audience == Audience.PUBLIC:
+        # After a clear, the removed tags are the ones remembered by index_retagged_images.
+        tag_ids = getattr(instance, '_cleared_ids', set()) if action == 'post_clear' else pk_set
+        bump(*(f'tag:{tag_id}' for tag_id in tag_ids))
+
+
+@receiver(post_save, sender=Album)
+def invalidate_album_pages(sender, instance, **kwargs):
+    album_changed(instance, was_public=getattr(instance, '_stored_audience', None) == Audience.PUBLIC)
+    instance._stored_audience = instance.audience
+
+
+@receiver(post_delete, sender=Album)
+def invalidate_deleted_album_pages(sender, instance, **kwargs):
+    album_changed(instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_pages(sender, instance, **kwargs):
+    tags_changed(instance.pk)
+
+# ----------------------------------------------------------------------------- 
+# Moderation Queue
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=Report)
+@receiver(post_delete, sender=Report)
+def refresh_reported_item(sender, instance, **kwargs):
+    refresh_queue(image_ids=[instance.image_id], comment_ids=[instance.comment_id])
+
 # ----------------------------------------------------------------------------- 
 # Moderation Functions
 # -----------------------------------------------------------------------------
@@ -425,7 +820,7 @@ def add_to_favorites(user, image):
     """Adds an image to the user's favorites and the 'Favorites' album."""
     Favorite.objects.get_or_create(user=user, image=image)
     album = Album.get_or_create_favorites_album(user)
-    album.images.add(image)
+    append_image(album, image)
 
 
 # ----------------------------------------------------------------------------- 
@@ -455,17 +850,36 @@ def unlike_album(user, album):
 class ImageVersion(models.Model):
     """Represents an older version of an image for versioning purposes."""
     image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="versions")
-    file = models.ImageField(upload_to="image_versions/")
+    file = models.ImageField(upload_to="image_versions/", storage=blob_storage)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        file_changed = not self.file._committed
+        if file_changed:
+            upload, size = self.file.file, self.file.size
+        super().save(*args, **kwargs)
+        if file_changed:
+            retain_blob(self.file.name, size, self.file.storage, upload)
+
     def __str__(self):
         return f"Version of {self.image.title} created at {self.created_at}"
 
 
+@receiver(post_delete, sender=Image)
+def release_image_file(sender, instance, **kwargs):
+    release_blob(instance.image_file.storage, instance.image_file.name, instance.renditions)
+
+
+@receiver(post_delete, sender=ImageVersion)
+def release_image_version_file(sender, instance, **kwargs):
+    release_blob(instance.file.storage, instance.file.name)
+
+
 class ModerationHistory(models.Model):
-    """Represents a history record of moderation actions (approval or rejection)."""
+    """Represents a history record of moderation actions (approval or rejection) on an image, comment or album."""
     image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="moderation_history", null=True, blank=True)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name="moderation_history", null=True, blank=True)
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name="moderation_history", null=True, blank=True)
     moderator = models.ForeignKey(User, on_delete=models.CASCADE)
     action = models.CharField(max_length=20, choices=[('approved', 'Approved'), ('rejected', 'Rejected')])
     timestamp = models.DateTimeField(auto_now_add=True)
@@ -512,7 +926,7 @@ def validate_album_capacity(album):
 
 def update_popularity_score(image):
     """Update the popularity score based on unique users who have added the image to their albums."""
-    image.popularity_score = image.likes.count() * 2 + image.views
+    image.popularity_score = image.like_count * 2 + image.views
     image.save()
 
 
@@ -526,7 +940,7 @@ def handle_comment_moderation(comment):
 def add_image_to_album(user, image, album_id):
     """Adds an image to the specified album."""
     album = Album.objects.get(id=album_id, user=user)
-    album.images.add(image)
+    append_image(album, image)
 
 @require_POST
 @csrf_exempt
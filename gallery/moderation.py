@@ -0,0 +1,180 @@
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q
+from django.utils.timezone import now
+
+from .pagecache import bump
+
+# Moderation action -> (new moderation status, ModerationHistory action)
+CONTENT_ACTIONS = {
+    'approve': ('APPROVED', 'approved'),
+    'reject': ('REJECTED', 'rejected'),
+}
+ACTIONS = [*CONTENT_ACTIONS, 'resolve']
+
+# Weight of one open report of each type in a queue item's priority.
+REPORT_WEIGHTS = {'ABUSE': 3.0, 'SPAM': 2.0, 'OTHER': 1.0}
+
+# Highest priority first, then the most recently reported; matches the queue indexes.
+QUEUE_ORDERING = ('-priority', '-last_reported_at', '-id')
+
+
+def _moderate_content(model, ids, status, moderator, moderated_at):
+    """
+    Moves the rows of ``model`` among ``ids`` that are not already in ``status`` to it, with
+    one SELECT and one bulk UPDATE. Returns the changed rows; images and albums are marked
+    with ``was_public`` for page cache invalidation.
+    """
+    from .models import Audience, Image, audience_for
+
+    fields = ['moderation_status', 'moderation_updated_at', 'moderated_by']
+    # Images and albums store the audience their privacy and status give them.
+    has_audience = hasattr(model, 'audience')
+    rows = list(
+        model.objects.select_for_update()
+        .filter(pk__in=ids).exclude(moderation_status=status)
+        .only(*fields, *(['privacy', 'audience'] if has_audience else []))
+    )
+    for row in rows:
+        row.moderation_status = status
+        row.moderation_updated_at = moderated_at
+        row.moderated_by = moderator
+        if has_audience:
+            row.was_public = row.audience == Audience.PUBLIC
+            row.audience = audience_for(row.privacy, status)
+    if has_audience:
+        fields.append('audience')
+    if model is Image:
+        # Cards show the moderation state, so cached ones must not be reused.
+        fields.append('card_version')
+        for row in rows:
+            row.card_version = F('card_version') + 1
+    model.objects.bulk_update(rows, fields, batch_size=500)
+    return rows
+
+
+def _invalidate_pages(images, albums):
+    from .models import Audience, Image
+
+    public = [image.pk for image in images if image.was_public or image.audience == Audience.PUBLIC]
+    if public:
+        tag_ids = Image.tags.through.objects.filter(image_id__in=public).values_list('tag_id', flat=True).distinct()
+        bump('images', *(f'tag:{tag_id}' for tag_id in tag_ids))
+    if any(album.was_public or album.audience == Audience.PUBLIC for album in albums):
+        bump('albums')
+
+
+def refresh_queue(image_ids=(), comment_ids=()):
+    """
+    Recomputes the moderation queue entries of the given images and comments from their
+    open reports: one grouped query and one upsert per kind, and items left without open
+    reports are dropped from the queue.
+    """
+    from .models import ModerationQueueItem, Report
+
+    type_counts = {f'{report_type.lower()}_reports': report_type for report_type in REPORT_WEIGHTS}
+    for field, ids in (('image', image_ids), ('comment', comment_ids)):
+        ids = {pk for pk in ids if pk is not None}
+        if not ids:
+            continue
+        rows = (
+            Report.objects.filter(status='PENDING', **{f'{field}_id__in': ids})
+            .values(f'{field}_id').order_by()
+            .annotate(
+                open_reports=Count('id'),
+                first_reported_at=Min('created_at'),
+                last_reported_at=Max('created_at'),
+                **{name: Count('id', filter=Q(report_type=report_type)) for name, report_type in type_counts.items()},
+            )
+        )
+        items = [
+            ModerationQueueItem(
+                **row, priority=sum(row[name] * REPORT_WEIGHTS[report_type] for name, report_type in type_counts.items()),
+            )
+            for row in rows
+        ]
+        if items:
+            ModerationQueueItem.objects.bulk_create(
+                items, update_conflicts=True, unique_fields=[field],
+                update_fields=['open_reports', 'first_reported_at', 'last_reported_at', *type_counts, 'priority'],
+            )
+        queued = {getattr(item, f'{field}_id') for item in items}
+        ModerationQueueItem.objects.filter(**{f'{field}_id__in': ids - queued}).delete()
+
+
+def rebuild_queue(chunk_size=1000):
+    """Recomputes the whole moderation queue from the open reports; returns the number of items queued."""
+    from .models import ModerationQueueItem, Report
+
+    with transaction.atomic():
+        ModerationQueueItem.objects.all().delete()
+        for field in ('image', 'comment'):
+            ids = list(Report.objects.filter(status='PENDING', **{f'{field}__isnull': False}).values_list(f'{field}_id', flat=True).distinct())
+            for start in range(0, len(ids), chunk_size):
+                refresh_queue(**{f'{field}_ids': ids[start:start + chunk_size]})
+        return ModerationQueueItem.objects.count()
+
+
+def resolve_reports(report_ids):
+    """Marks the open reports among ``report_ids`` resolved and returns how many were."""
+    from .models import Report
+
+    reports = Report.objects.filter(pk__in=report_ids, status='PENDING')
+    targets = list(reports.values_list('image_id', 'comment_id'))
+    resolved = reports.update(status='RESOLVED')
+    refresh_queue(image_ids=[image_id for image_id, _ in targets], comment_ids=[comment_id for _, comment_id in targets])
+    return resolved
+
+
+def close_reports(image_ids=(), comment_ids=()):
+    """
+    Resolves the open reports against the given images and comments and drops their
+    moderation queue items, with one UPDATE and one DELETE. Returns the reports resolved.
+    """
+    from .models import ModerationQueueItem, Report
+
+    if not (image_ids or comment_ids):
+        return 0
+    targets = Q(image_id__in=image_ids) | Q(comment_id__in=comment_ids)
+    # A bulk UPDATE skips the Report receivers, so the queue items are removed here.
+    resolved = Report.objects.filter(targets, status='PENDING').update(status='RESOLVED')
+    ModerationQueueItem.objects.filter(targets).delete()
+    return resolved
+
+
+def moderate(moderator, action, images=(), comments=(), albums=(), reports=()):
+    """
+    Applies ``action`` to the given ids in one transaction: ``approve`` and ``reject`` set
+    the moderation status of images, comments and albums, and ``resolve`` closes reports.
+    Rejecting images and comments also closes their reports and queue items.
+    Each model costs one SELECT and one bulk UPDATE, and the moderation history of the
+    whole batch is written with a single INSERT. Rows already in the target state are
+    left alone. Returns the number of rows changed per kind.
+    """
+    from .models import Album, Comment, Image, ModerationHistory
+
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown moderation action {action!r}')
+    changed = {'images': 0, 'comments': 0, 'albums': 0, 'reports': 0}
+    with transaction.atomic():
+        if action == 'resolve':
+            changed['reports'] = resolve_reports(reports)
+            return changed
+
+        status, history_action = CONTENT_ACTIONS[action]
+        moderated_at = now()
+        history = []
+        rows = {}
+        # (kind, model, ids, ModerationHistory field)
+        for kind, model, ids, field in [
+            ('images', Image, images, 'image'),
+            ('comments', Comment, comments, 'comment'),
+            ('albums', Album, albums, 'album'),
+        ]:
+            rows[kind] = _moderate_content(model, ids, status, moderator, moderated_at) if ids else []
+            history += [ModerationHistory(moderator=moderator, action=history_action, **{field: row}) for row in rows[kind]]
+            changed[kind] = len(rows[kind])
+        ModerationHistory.objects.bulk_create(history)
+        if action == 'reject':
+            changed['reports'] = close_reports(images, comments)
+        _invalidate_pages(rows['images'], rows['albums'])
+    return changed
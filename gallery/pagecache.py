@@ -0,0 +1,122 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import urlencode
+
+
+def page_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'default')]
+
+
+def _generation_key(scope):
+    return f'gallery:pagegen:{scope}'
+
+
+def bump(*scopes):
+    """
+    Invalidates every cached page of the given scopes once the current transaction commits,
+    by moving their generation counters on. Stale entries are never read again and expire
+    with ``PAGE_CACHE_TIMEOUT``.
+    """
+    scopes = set(scopes)
+    if not scopes:
+        return
+
+    def apply():
+        cache = page_cache()
+        for scope in scopes:
+            try:
+                cache.incr(_generation_key(scope))
+            except ValueError:
+                # A missing counter restarts from the clock so it cannot reuse an old generation.
+                cache.set(_generation_key(scope), time.time_ns(), None)
+    transaction.on_commit(apply)
+
+
+def _generations(cache, scopes):
+    keys = [_generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    for key, value in missing.items():
+        # add() keeps a counter another process created meanwhile.
+        if not cache.add(key, value, None):
+            value = cache.get(key, value)
+        found[key] = value
+    return [str(found[key]) for key in keys]
+
+
+def page_key(view_name, scopes, request, generations):
+    """Returns the cache key of a page: the view, its path (and so its arguments), query string and scope generations."""
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    versions = '.'.join(f'{scope}={generation}' for scope, generation in zip(scopes, generations))
+    digest = hashlib.md5(f'{request.path}\n{query}\n{versions}'.encode(), usedforsecurity=False).hexdigest()
+    return f"gallery:page:{view_name}:{digest}"
+
+
+def _cacheable_request(request):
+    # Pending flash messages are rendered into the page and must not be shared.
+    return request.method == 'GET' and not request.user.is_authenticated and 'messages' not in request.COOKIES
+
+
+def _cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # A page that used the CSRF token carries a secret tied to this visitor.
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def cache_anonymous_page(view_name, scopes):
+    """
+    Caches a view's response for logged-out visitors, keyed on the view, its path and
+    query string (filter, cursor, colour) and the generations of the ``scopes`` it reads.
+    ``scopes`` is called with the view's keyword arguments and returns the scope names.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable_request(request):
+                return view(request, *args, **kwargs)
+            cache = page_cache()
+            scope_names = scopes(**kwargs)
+            key = page_key(view_name, scope_names, request, _generations(cache, scope_names))
+            response = cache.get(key)
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if _cacheable_response(request, response):
+                cache.set(key, response, getattr(settings, 'PAGE_CACHE_TIMEOUT', 300))
+            return response
+        return wrapper
+    return decorator
+
+
+# -----------------------------------------------------------------------------
+# Invalidation
+# -----------------------------------------------------------------------------
+
+def image_changed(image, tag_ids=None, was_public=False):
+    """Invalidates the anonymous pages listing ``image`` if it is, or was, public."""
+    from .models import Audience
+
+    if was_public or image.audience == Audience.PUBLIC:
+        if tag_ids is None:
+            tag_ids = image.tags.values_list('id', flat=True)
+        bump('images', *(f'tag:{tag_id}' for tag_id in tag_ids))
+
+
+def album_changed(album, was_public=False):
+    from .models import Audience
+
+    if was_public or album.audience == Audience.PUBLIC:
+        bump('albums')
+
+
+def tags_changed(*tag_ids):
+    bump('tags', *(f'tag:{tag_id}' for tag_id in tag_ids))
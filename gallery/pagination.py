@@ -0,0 +1,123 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPage:
+    """One page of a ``CursorPaginator``, exposing opaque tokens for the neighbouring pages."""
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1], reverse=False)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], reverse=True)
+        return None
+
+
+class CursorPaginator:
+    """
+    Keyset paginator. Each page is fetched with ``WHERE (keys) > (cursor) ORDER BY keys
+    LIMIT n``, so neither a COUNT nor an OFFSET scan is needed and deep pages cost the
+    same as the first one.
+
+    ``ordering`` lists the sort keys as model fields or annotations, with a ``-`` prefix
+    for descending order; the last key must be unique (normally ``id``).
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = [(key.lstrip('-'), key.startswith('-')) for key in ordering]
+
+    def encode_cursor(self, obj, reverse):
+        values = [getattr(obj, name) for name, _ in self.ordering]
+        # DjangoJSONEncoder drops microseconds, which would make the seek skip rows.
+        values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+        data = json.dumps({'v': values, 'r': reverse}, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            values, reverse = data['v'], bool(data['r'])
+            if len(values) != len(self.ordering):
+                raise InvalidCursor(cursor)
+            return [self._to_python(name, value) for (name, _), value in zip(self.ordering, values)], reverse
+        except (ValueError, KeyError, TypeError, ValidationError):
+            raise InvalidCursor(cursor)
+
+    def _to_python(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations are numeric and survive the JSON round trip unchanged.
+            return value
+        return field.to_python(value)
+
+    def _seek(self, values, reverse):
+        """Builds the filter selecting rows after ``values`` in the (possibly reversed) ordering."""
+        condition = Q()
+        for i, (name, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[i]})
+            for j, (prev_name, _) in enumerate(self.ordering[:i]):
+                clause &= Q(**{prev_name: values[j]})
+            condition |= clause
+        return condition
+
+    def _order_by(self, reverse):
+        return [f"{'-' if descending != reverse else ''}{name}" for name, descending in self.ordering]
+
+    def get_page(self, cursor=None):
+        """Returns the page after (or, for a previous-page token, before) ``cursor``; invalid tokens give the first page."""
+        values, reverse = None, False
+        if cursor:
+            try:
+                values, reverse = self.decode_cursor(cursor)
+            except InvalidCursor:
+                values = None
+
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return CursorPage(rows, self, has_next=True, has_previous=has_more)
+        return CursorPage(rows, self, has_next=has_more, has_previous=values is not None)
@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """
+    Records every statement run on any database connection while it is active. It hooks in
+    through ``execute_wrapper`` rather than ``connection.queries``, so it works with
+    ``DEBUG`` off and costs one function call per query.
+    """
+
+    def __init__(self):
+        self.queries = []  # (sql, seconds)
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._stack = None
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(seconds for _, seconds in self.queries)
+
+
+def get_query_budget(view_name):
+    """Returns the most queries ``view_name`` may run per request, from ``QUERY_BUDGETS``, or None."""
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+
+_stats = {}  # view name -> [requests, queries, most queries in one request]
+_stats_lock = threading.Lock()
+
+
+def _record(view_name, recorder):
+    with _stats_lock:
+        stats = _stats.setdefault(view_name, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += recorder.count
+        stats[2] = max(stats[2], recorder.count)
+
+
+def query_stats():
+    """Returns ``{view name: (requests, queries, most queries in one request)}`` for this process."""
+    with _stats_lock:
+        return {view_name: tuple(stats) for view_name, stats in _stats.items()}
+
+
+def reset_query_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class QueryCountMiddleware:
+    """
+    Counts the queries of each request and aggregates them per URL name. Requests that go
+    over their view's budget are logged with their statements, and the count is exposed in
+    an ``X-Query-Count`` header when ``QUERY_COUNT_HEADER`` is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        view_name = match.view_name if match else None
+        if view_name:
+            _record(view_name, recorder)
+            budget = get_query_budget(view_name)
+            if budget is not None and recorder.count > budget:
+                logger.warning(
+                    "%s ran %d queries (budget %d) in %.1f ms: %s",
+                    request.path, recorder.count, budget, recorder.duration * 1000,
+                    '; '.join(sql for sql, _ in recorder.queries),
+                )
+        if getattr(settings, 'QUERY_COUNT_HEADER', False):
+            response['X-Query-Count'] = str(recorder.count)
+        return response
@@ -0,0 +1,137 @@
+import random
+import time
+from collections import namedtuple
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.utils.timezone import now
+
+PRIVACY_CHOICES = ['public', 'public', 'public', 'users', 'followers', 'private']
+
+QueryPlan = namedtuple('QueryPlan', 'name index build')
+
+
+def _newest_images(images):
+    return images.order_by('-uploaded_at', '-id')[:21]
+
+
+def _plans():
+    from .models import Album, Comment, Image, ModerationQueueItem, ModerationStatus, UserActivity
+    from .moderation import QUEUE_ORDERING
+
+    # The main query of each view, built the way the view builds it, and the index it should use.
+    return [
+        QueryPlan('gallery, anonymous', 'image_audience_newest_idx',
+                  lambda f: _newest_images(Image.objects.get_filtered_images(AnonymousUser()))),
+        QueryPlan('gallery, member', 'image_audience_newest_idx',
+                  lambda f: _newest_images(Image.objects.get_filtered_images(f.member))),
+        QueryPlan('album gallery', 'album_audience_newest_idx',
+                  lambda f: Album.objects.get_filtered_albums(AnonymousUser()).order_by('-created_at', '-id')[:21]),
+        QueryPlan('user gallery', 'image_user_newest_idx',
+                  lambda f: _newest_images(Image.objects.get_filtered_images(f.member).filter(user=f.owner))),
+        QueryPlan('image comments', 'comment_image_newest_idx',
+                  lambda f: Comment.objects.filter(image=f.image).order_by('-created_at')),
+        QueryPlan('pending images', 'image_pending_idx',
+                  lambda f: Image.objects.filter(moderation_status=ModerationStatus.PENDING)),
+        QueryPlan('reported images', 'queue_image_priority_idx',
+                  lambda f: ModerationQueueItem.objects.filter(image__isnull=False).order_by(*QUEUE_ORDERING)[:21]),
+        QueryPlan('reported comments', 'queue_comment_priority_idx',
+                  lambda f: ModerationQueueItem.objects.filter(comment__isnull=False).order_by(*QUEUE_ORDERING)[:21]),
+        QueryPlan('activity feed', 'activity_user_recent_idx',
+                  lambda f: UserActivity.objects.filter(user=f.member).order_by('-timestamp')[:20]),
+    ]
+
+
+def seed(rows, seed=0):
+    """
+    Bulk-creates ``rows`` images, with comments, reports and activity in proportion, spread
+    over a year and over every privacy and moderation state. Returns the fixture the plans
+    are built from: a ``member``, an ``owner`` they follow, and one of the owner's images.
+    """
+    from .models import (
+        Album, Comment, Follow, Image, ModerationStatus, Report, UserActivity, audience_for,
+    )
+    from .moderation import REPORT_WEIGHTS, rebuild_queue
+
+    rng = random.Random(seed)
+    start = now() - timedelta(days=365)
+    stamp = lambda: start + timedelta(seconds=rng.randrange(365 * 86400))  # noqa: E731
+    status = lambda: ModerationStatus.PENDING if rng.random() < 0.05 else ModerationStatus.APPROVED  # noqa: E731
+
+    prefix = f'seed{time.time_ns()}'
+    users = User.objects.bulk_create(
+        User(username=f'{prefix}-{n}') for n in range(max(rows // 50, 10))
+    )
+    member, owner = users[0], users[1]
+    followed = {owner, *rng.sample(users[2:], len(users) // 4)}
+    Follow.objects.bulk_create(Follow(follower=member, followed=user) for user in followed)
+
+    images = []
+    for n in range(rows):
+        privacy, moderation_status = rng.choice(PRIVACY_CHOICES), status()
+        images.append(Image(
+            user=owner if n == 0 else rng.choice(users), title=f'Seeded {n}', image_file=f'seed/{n}.jpg',
+            uploaded_at=stamp(), privacy=privacy, moderation_status=moderation_status,
+            audience=audience_for(privacy, moderation_status),
+        ))
+    images = Image.objects.bulk_create(images, batch_size=500)
+
+    comments = Comment.objects.bulk_create(
+        (Comment(image=rng.choice(images), user=rng.choice(users), content='Seeded', moderation_status=status())
+         for _ in range(rows)),
+        batch_size=500,
+    )
+    Report.objects.bulk_create(
+        (Report(reported_by=rng.choice(users), report_type=rng.choice(list(REPORT_WEIGHTS)),
+                status='PENDING' if rng.random() < 0.1 else 'RESOLVED',
+                **({'image': rng.choice(images)} if rng.random() < 0.5 else {'comment': rng.choice(comments)}))
+         for _ in range(max(rows // 10, 10))),
+        batch_size=500,
+    )
+    # bulk_create skips the signals that keep the queue current.
+    rebuild_queue()
+    UserActivity.objects.bulk_create(
+        (UserActivity(user=rng.choice(users), action='liked', target_image=rng.choice(images)) for _ in range(rows)),
+        batch_size=500,
+    )
+    albums = []
+    for n in range(max(rows // 10, 10)):
+        privacy, moderation_status = rng.choice(PRIVACY_CHOICES), status()
+        albums.append(Album(
+            user=rng.choice(users), name=f'Seeded {n}', privacy=privacy, moderation_status=moderation_status,
+            audience=audience_for(privacy, moderation_status),
+        ))
+    Album.objects.bulk_create(albums, batch_size=500)
+
+    # Refresh the planner statistics so PostgreSQL judges the seeded tables by their real size.
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return SimpleNamespace(member=member, owner=owner, image=images[0])
+
+
+def explain(queryset):
+    return queryset.explain()
+
+
+def uses_index(plan, index):
+    """True if an EXPLAIN output, from SQLite or PostgreSQL, reads through ``index``."""
+    return index in plan
+
+
+def check_plans(fixture, repeat=5):
+    """
+    Explains and times the main query of each view against ``fixture``. Returns a list of
+    ``(plan, explain output, uses its index, best time in milliseconds)``.
+    """
+    results = []
+    for plan in _plans():
+        output = explain(plan.build(fixture))
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(plan.build(fixture))
+            best = min(best, time.perf_counter() - started)
+        results.append((plan, output, uses_index(output, plan.index), best * 1000))
+    return results
@@ -0,0 +1,234 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Side table holding one search document per Image. It is created outside the migrations,
+# by the post_migrate handler in apps.py or the rebuild_search_index command.
+SEARCH_TABLE = 'gallery_image_search'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Splits a user query into lowercase word tokens, dropping any search syntax."""
+    return TOKEN_RE.findall((query or '').lower())
+
+
+class SQLiteBackend:
+    """FTS5 virtual table keyed by the image id, ranked with BM25."""
+
+    # BM25 column weights: title, description, tags, category.
+    weights = (10.0, 2.0, 5.0, 3.0)
+
+    def table_exists(self, cursor):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [SEARCH_TABLE])
+        return cursor.fetchone() is not None
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "title, description, tags, category, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def delete(self, cursor, image_ids):
+        placeholders = ', '.join(['%s'] * len(image_ids))
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", list(image_ids))
+
+    def upsert(self, cursor, documents):
+        self.delete(cursor, [document[0] for document in documents])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, description, tags, category) VALUES (%s, %s, %s, %s, %s)",
+            documents,
+        )
+
+    def match(self, tokens):
+        # Every token must appear, each as a word prefix so partial words still match.
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def matching_ids(self, tokens):
+        return RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [self.match(tokens)])
+
+    def rank(self, tokens):
+        weights = ', '.join(str(weight) for weight in self.weights)
+        # bm25() is lower for better matches, so it is negated to sort descending like the other orderings.
+        return RawSQL(
+            f"SELECT -bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = gallery_image.id",
+            [self.match(tokens)],
+            output_field=FloatField(),
+        )
+
+
+class PostgreSQLBackend:
+    """Weighted ``tsvector`` side table with a GIN index, ranked with ``ts_rank_cd``."""
+
+    document = (
+        "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'C') || "
+        "setweight(to_tsvector('simple', %s), 'B') || setweight(to_tsvector('simple', %s), 'B')"
+    )
+
+    def table_exists(self, cursor):
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [SEARCH_TABLE])
+        return cursor.fetchone()[0]
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "image_id bigint PRIMARY KEY REFERENCES gallery_image (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING gin (document)")
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def delete(self, cursor, image_ids):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE image_id = ANY(%s)", [list(image_ids)])
+
+    def upsert(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (image_id, document) VALUES (%s, {self.document}) "
+            "ON CONFLICT (image_id) DO UPDATE SET document = EXCLUDED.document",
+            documents,
+        )
+
+    def match(self, tokens):
+        return ' & '.join(f'{token}:*' for token in tokens)
+
+    def matching_ids(self, tokens):
+        return RawSQL(
+            f"SELECT image_id FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('simple', %s)",
+            [self.match(tokens)],
+        )
+
+    def rank(self, tokens):
+        return RawSQL(
+            f"SELECT ts_rank_cd(document, to_tsquery('simple', %s)) FROM {SEARCH_TABLE} "
+            "WHERE image_id = gallery_image.id",
+            [self.match(tokens)],
+            output_field=FloatField(),
+        )
+
+
+BACKENDS = {'sqlite': SQLiteBackend(), 'postgresql': PostgreSQLBackend()}
+
+
+def get_backend():
+    """Returns the index backend for the default database, or ``None`` if it has none."""
+    return BACKENDS.get(connection.vendor)
+
+
+# -----------------------------------------------------------------------------
+# Indexing
+# -----------------------------------------------------------------------------
+
+def build_documents(image_ids):
+    """Returns ``(image id, title, description, tags, category)`` rows for the given images."""
+    from .models import Image
+
+    images = (
+        Image.objects.filter(id__in=image_ids)
+        .select_related('category')
+        .prefetch_related('tags')
+        .only('id', 'title', 'description', 'category__name')
+    )
+    return [
+        (
+            image.id,
+            image.title or '',
+            image.description or '',
+            ' '.join(tag.name for tag in image.tags.all()),
+            image.category.name if image.category else '',
+        )
+        for image in images
+    ]
+
+
+def index_images(image_ids):
+    """Writes the search documents of the given images, dropping those of images that no longer exist."""
+    backend = get_backend()
+    image_ids = list(image_ids)
+    if backend is None or not image_ids:
+        return
+    documents = build_documents(image_ids)
+    found = {document[0] for document in documents}
+    with transaction.atomic(), connection.cursor() as cursor:
+        missing = [image_id for image_id in image_ids if image_id not in found]
+        if missing:
+            backend.delete(cursor, missing)
+        if documents:
+            backend.upsert(cursor, documents)
+
+
+def unindex_images(image_ids):
+    backend = get_backend()
+    image_ids = list(image_ids)
+    if backend is None or not image_ids:
+        return
+    with connection.cursor() as cursor:
+        backend.delete(cursor, image_ids)
+
+
+def ensure_search_index(**kwargs):
+    """Creates the search table if it is missing, filling it from the existing images."""
+    backend = get_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        if backend.table_exists(cursor):
+            return
+    rebuild_search_index()
+
+
+def rebuild_search_index(chunk_size=1000, progress=None):
+    """Drops and recreates the search table, then indexes every image in id order. Returns the number indexed."""
+    from .models import Image
+
+    backend = get_backend()
+    if backend is None:
+        return 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            backend.drop(cursor)
+            backend.create(cursor)
+        last_id = indexed = 0
+        while True:
+            ids = list(Image.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            index_images(ids)
+            last_id = ids[-1]
+            indexed += len(ids)
+            if progress:
+                progress(indexed, last_id)
+    return indexed
+
+
+# -----------------------------------------------------------------------------
+# Querying
+# -----------------------------------------------------------------------------
+
+def search(queryset, query):
+    """
+    Restricts an Image ``queryset`` to images matching every word of ``query`` (as word
+    prefixes) and annotates each with ``search_rank``, higher for better matches. Without
+    an index backend it falls back to ``icontains`` filters with a constant rank.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+    backend = get_backend()
+    if backend is None:
+        for token in tokens:
+            queryset = queryset.filter(
+                Q(title__icontains=token) | Q(description__icontains=token) |
+                Q(tags__name__icontains=token) | Q(category__name__icontains=token)
+            )
+        return queryset.distinct().annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return queryset.filter(id__in=backend.matching_ids(tokens)).annotate(search_rank=backend.rank(tokens))
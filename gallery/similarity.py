@@ -0,0 +1,156 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from .imaging import to_unsigned64
+
+
+def hamming(a, b):
+    """Returns the number of differing bits between two hashes."""
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes. Each child edge is labelled with its Hamming
+    distance from the parent, so a range query only descends into edges that the
+    triangle inequality cannot rule out.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item_id):
+        # Nodes are [hash, [item ids], {distance: child}].
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item_id], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item_id], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Returns ``(distance, item_id)`` pairs for every hash within ``max_distance``."""
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item_id) for item_id in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+# -----------------------------------------------------------------------------
+# Image index
+# -----------------------------------------------------------------------------
+
+# Hashes written shortly before a catch-up may commit after it, so each catch-up re-reads
+# this much of the time before the previous one; rows already indexed are skipped.
+CATCH_UP_OVERLAP = timedelta(seconds=60)
+
+
+class PerceptualIndex:
+    """In-process BK-tree of every hashed Image, caught up with newly hashed rows on each query."""
+
+    def __init__(self):
+        self.tree = BKTree()
+        self.hashes = {}
+        self.hashed_until = None
+        self.stale = False
+        self.built_at = time.monotonic()
+
+    def add(self, image_id, phash):
+        if phash is None:
+            return
+        value = to_unsigned64(phash)
+        if image_id in self.hashes:
+            # Nodes cannot be moved, so a re-hashed image calls for a rebuild.
+            self.stale = self.stale or self.hashes[image_id] != value
+            return
+        self.hashes[image_id] = value
+        self.tree.add(value, image_id)
+
+    def catch_up(self):
+        """Adds the images hashed since the last catch-up, whatever their id."""
+        from .models import Image
+
+        started = now()
+        rows = Image.objects.filter(phash__isnull=False)
+        if self.hashed_until is not None:
+            rows = rows.filter(phash_updated_at__gte=self.hashed_until - CATCH_UP_OVERLAP)
+        for image_id, phash in rows.values_list('id', 'phash').iterator():
+            self.add(image_id, phash)
+        self.hashed_until = started
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the process-wide index. Rows hashed since the last query are appended, and the
+    tree is rebuilt when one of them was re-hashed, and after ``SIMILARITY_INDEX_TTL``
+    seconds to drop deleted images.
+    """
+    global _index
+    with _index_lock:
+        ttl = getattr(settings, 'SIMILARITY_INDEX_TTL', 300)
+        if _index is None or time.monotonic() - _index.built_at > ttl:
+            _index = PerceptualIndex()
+        _index.catch_up()
+        if _index.stale:
+            _index = PerceptualIndex()
+            _index.catch_up()
+        return _index
+
+
+def find_similar_ids(image_ids, k=10, max_distance=10):
+    """
+    Returns ``{image_id: [(distance, similar_id), ...]}`` with the ``k`` nearest hashed
+    images within ``max_distance`` bits of each given image, nearest first.
+    """
+    index = get_index()
+    results = {}
+    for image_id in image_ids:
+        value = index.hashes.get(image_id)
+        if value is None:
+            results[image_id] = []
+            continue
+        matches = sorted(match for match in index.tree.search(value, max_distance) if match[1] != image_id)
+        results[image_id] = matches[:k]
+    return results
+
+
+def find_similar(image, queryset, k=10, max_distance=10):
+    """Returns ``(image, distance)`` pairs from ``queryset`` that look like ``image``, nearest first."""
+    return find_similar_many([image], queryset, k, max_distance)[image.id]
+
+
+def find_similar_many(images, queryset, k=10, max_distance=10):
+    """Batch form of ``find_similar``, fetching every match in a single query."""
+    # Over-fetch so that matches hidden by ``queryset`` do not leave the result short.
+    matches = find_similar_ids([image.id for image in images], k * 2, max_distance)
+    wanted = {similar_id for pairs in matches.values() for _, similar_id in pairs}
+    found = queryset.in_bulk(wanted) if wanted else {}
+    return {
+        image_id: [(found[similar_id], distance) for distance, similar_id in pairs if similar_id in found][:k]
+        for image_id, pairs in matches.items()
+    }
@@ -0,0 +1,148 @@
+import os
+import uuid
+
+import xxhash
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+from .imaging import RENDITION_FORMATS, RENDITION_WIDTHS, rendition_name
+
+# Directory, relative to MEDIA_ROOT, holding content-addressed files.
+BLOB_PREFIX = 'blobs'
+
+
+def content_digest(content):
+    """Returns the xxh3-128 hex digest of a file, reading it in chunks."""
+    hasher = xxhash.xxh3_128()
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()
+
+
+def blob_name(digest, ext):
+    """Returns the storage name of a content-addressed file."""
+    return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX + '/')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names uploads after a hash of their contents, so identical
+    bytes are written once however many times they are uploaded. Files saved under an
+    existing blob name (such as renditions of a blob) are stored as-is.
+    """
+
+    def save(self, name, content, max_length=None):
+        if is_blob(name):
+            return super().save(name, content, max_length)
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        content.seek(0)
+        name = blob_name(content_digest(content), os.path.splitext(name)[1].lower())
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # A blob's name stands for its bytes, so it is never changed to avoid a clash.
+        if is_blob(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not is_blob(name):
+            return super()._save(name, content)
+        if self.exists(name):
+            return name
+        # Written under a temporary name and moved into place, so a racing save of the same
+        # blob replaces identical bytes instead of clashing.
+        directory, filename = os.path.split(name)
+        temporary = super()._save(f"{directory}/.{filename}.{uuid.uuid4().hex}", content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+# -----------------------------------------------------------------------------
+# Reference counting
+# -----------------------------------------------------------------------------
+
+def retain_blob(name, size=None, storage=None, content=None):
+    """
+    Records one more model row referencing the blob ``name``. When ``content`` is the
+    upload that was saved as ``name`` in ``storage``, a blob deleted by a concurrent release
+    after the upload found it is written back from it.
+    """
+    from .models import MediaBlob
+
+    if not is_blob(name):
+        return
+    while not MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+        try:
+            with transaction.atomic():
+                MediaBlob.objects.create(name=name, size=size, ref_count=1)
+            break
+        except IntegrityError:
+            continue
+    # Counted first, so any release that has not deleted the file yet now leaves it alone.
+    if content is not None and not storage.exists(name):
+        content.seek(0)
+        storage.save(name, content)
+
+
+def derived_names(name, renditions=None):
+    """Returns the names of the files derived from the blob ``name``: its renditions."""
+    root = os.path.splitext(name)[0]
+    names = {rendition_name(name, width, fmt) for width in RENDITION_WIDTHS for fmt in RENDITION_FORMATS}
+    # Images narrower than the largest rendition also get one at their own width.
+    names.update(
+        derived for by_width in (renditions or {}).values() for derived in by_width.values()
+        if derived.startswith(root + '_')
+    )
+    return names
+
+
+def delete_blob(storage, name, renditions=None):
+    """Deletes a blob together with its renditions; ``renditions`` is a rendition map naming any extra ones."""
+    for derived in derived_names(name, renditions):
+        storage.delete(derived)
+    storage.delete(name)
+
+
+def _delete_unreferenced_blob(storage, name, renditions):
+    from .models import MediaBlob
+
+    with transaction.atomic():
+        # The row lock makes a concurrent retain wait, then find no row and restore the file.
+        if MediaBlob.objects.select_for_update().filter(name=name, ref_count=0).exists():
+            delete_blob(storage, name, renditions)
+            MediaBlob.objects.filter(name=name, ref_count=0).delete()
+
+
+def release_blob(storage, name, renditions=None):
+    """
+    Drops one reference to the blob ``name``, deleting the file and its renditions after
+    commit if nothing references it by then. Files that were never tracked as blobs are
+    left untouched.
+    """
+    from .models import MediaBlob
+
+    if not is_blob(name):
+        return
+    with transaction.atomic():
+        ref_count = (
+            MediaBlob.objects.select_for_update().filter(name=name, ref_count__gt=0)
+            .values_list('ref_count', flat=True).first()
+        )
+        if ref_count is None:
+            return
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') - 1)
+    if ref_count == 1:
+        transaction.on_commit(lambda: _delete_unreferenced_blob(storage, name, renditions))
@@ -0,0 +1,85 @@
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .pagecache import tags_changed
+
+
+def _key(name):
+    return name.lower()
+
+
+def normalize_tag_names(names):
+    """
+    Strips and collapses the whitespace of ``names``, cuts them to the length a tag name
+    may have and drops blanks and case-insensitive repeats, keeping the first spelling.
+    """
+    from .models import Tag
+
+    max_length = Tag._meta.get_field('name').max_length
+    normalized = {}
+    for name in names:
+        name = ' '.join(name.split())[:max_length].strip()
+        if name:
+            normalized.setdefault(_key(name), name)
+    return list(normalized.values())
+
+
+def get_or_create_tags(names):
+    """
+    Returns a tag for each of the normalized ``names``, matching existing tags regardless
+    of case. Existing tags are read with one ``IN`` query and the missing ones are inserted
+    with one bulk INSERT, so a tag created concurrently is picked up instead of failing.
+    """
+    from .models import Tag
+
+    wanted = {_key(name): name for name in names}
+    if not wanted:
+        return []
+    lookup = lambda: Tag.objects.alias(key=Lower('name')).filter(key__in=wanted)  # noqa: E731
+    tags = {_key(tag.name): tag for tag in lookup()}
+    missing = [name for key, name in wanted.items() if key not in tags]
+    if missing:
+        # Conflicts include case variants created concurrently, through the Lower(name) constraint.
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        tags = {_key(tag.name): tag for tag in lookup()}
+        # bulk_create skips post_save: new tags are pending, so autocomplete has nothing to add,
+        # but the cached tag pages must be dropped, which tags_changed does once this commits.
+        tags_changed(*(tags[_key(name)].pk for name in missing if _key(name) in tags))
+    return [tags[key] for key in wanted if key in tags]
+
+
+def _sync(image, current, names):
+    wanted = {_key(name): name for name in names}
+    kept = {}
+    for tag in current:
+        if _key(tag.name) in wanted:
+            kept.setdefault(_key(tag.name), tag)
+    kept_ids = {tag.pk for tag in kept.values()}
+    removed = [tag for tag in current if tag.pk not in kept_ids]
+    added = get_or_create_tags([name for key, name in wanted.items() if key not in kept])
+    added = [tag for tag in added if tag.pk not in kept_ids]
+    if not (added or removed):
+        return added, removed
+    # Going through the relation keeps the m2m_changed receivers (search, autocomplete, page cache) informed.
+    with transaction.atomic():
+        if removed:
+            image.tags.remove(*removed)
+        if added:
+            image.tags.add(*added)
+    return added, removed
+
+
+def set_image_tags(image, names):
+    """
+    Makes ``names`` the tags of ``image``, writing only the rows that differ from its
+    current tags. Returns the ``(added, removed)`` tags.
+    """
+    return _sync(image, list(image.tags.only('id', 'name')), normalize_tag_names(names))
+
+
+def edit_image_tags(image, add=(), remove=()):
+    """Adds the tags named in ``add`` to ``image`` and takes off those in ``remove``, as ``set_image_tags``."""
+    current = list(image.tags.only('id', 'name'))
+    removed = {_key(name) for name in normalize_tag_names(remove)}
+    names = normalize_tag_names([tag.name for tag in current] + list(add))
+    return _sync(image, current, [name for name in names if _key(name) not in removed])
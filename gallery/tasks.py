@@ -0,0 +1,216 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+# -----------------------------------------------------------------------------
+# Queue API
+# -----------------------------------------------------------------------------
+
+def task(func):
+    """Registers a function so it can be queued by name with ``enqueue``."""
+    _registry[func.__name__] = func
+    return func
+
+
+def enqueue(name, delay=0, max_attempts=None, **payload):
+    """
+    Queues the task registered under ``name`` with the given keyword arguments.
+
+    The row is written in the caller's transaction, so workers only see it once the
+    surrounding data has been committed. With ``TASKS_ALWAYS_EAGER`` the task runs
+    in-process after commit instead.
+    """
+    from .models import Task
+
+    if name not in _registry:
+        raise KeyError(f"Unknown task: {name}")
+    if getattr(settings, 'TASKS_ALWAYS_EAGER', False):
+        transaction.on_commit(lambda: _registry[name](**payload))
+        return None
+    return Task.objects.create(
+        name=name,
+        payload=payload,
+        run_after=now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or getattr(settings, 'TASK_MAX_ATTEMPTS', 5),
+    )
+
+
+def schedule(name, delay=0, **payload):
+    """
+    Queues a recurring task unless a run of it is already waiting, so repeated calls keep
+    a single chain alive. Recurring tasks need a worker, so nothing is queued when
+    ``TASKS_ALWAYS_EAGER`` is set.
+    """
+    from .models import Task, TaskStatus
+
+    if getattr(settings, 'TASKS_ALWAYS_EAGER', False):
+        return None
+    if Task.objects.filter(name=name, status=TaskStatus.PENDING).exists():
+        return None
+    return enqueue(name, delay=delay, **payload)
+
+
+def enqueue_once(name, delay=0, **payload):
+    """
+    Queues ``name`` like ``enqueue`` unless a run with the same payload is already
+    waiting, so a task requested again before a worker gets to it runs once.
+    """
+    from .models import Task, TaskStatus
+
+    if not getattr(settings, 'TASKS_ALWAYS_EAGER', False):
+        if Task.objects.filter(name=name, status=TaskStatus.PENDING, payload=payload).exists():
+            return None
+    return enqueue(name, delay=delay, **payload)
+
+
+def retry_delay(attempts):
+    """Returns the exponential backoff, in seconds, before retrying a failed task."""
+    base = getattr(settings, 'TASK_RETRY_BACKOFF', 30)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'TASK_RETRY_BACKOFF_MAX', 3600))
+
+
+def _claimable():
+    from .models import TaskStatus
+
+    stale = now() - timedelta(seconds=getattr(settings, 'TASK_LOCK_TIMEOUT', 600))
+    return (
+        Q(status=TaskStatus.PENDING, run_after__lte=now()) |
+        Q(status=TaskStatus.RUNNING, locked_at__lt=stale)
+    )
+
+
+def claim_tasks(limit):
+    """
+    Locks up to ``limit`` due tasks for this worker. Each claim is a conditional UPDATE,
+    so concurrent workers never run the same task twice. Tasks left RUNNING by a worker
+    that died are reclaimed once their lock times out.
+    """
+    from .models import Task, TaskStatus
+
+    candidates = list(
+        Task.objects.filter(_claimable()).order_by('run_after', 'id').values_list('id', flat=True)[:limit]
+    )
+    claimed = [
+        task_id for task_id in candidates
+        if Task.objects.filter(_claimable(), id=task_id).update(
+            status=TaskStatus.RUNNING, locked_at=now(), attempts=F('attempts') + 1,
+        )
+    ]
+    return list(Task.objects.filter(id__in=claimed).order_by('run_after', 'id'))
+
+
+def run_task(task_obj):
+    """Runs a claimed task, deleting it on success and scheduling a retry on failure."""
+    from .models import Task, TaskStatus
+
+    try:
+        _registry[task_obj.name](**task_obj.payload)
+    except Exception:
+        logger.exception("Task %s (%s) failed", task_obj.id, task_obj.name)
+        if task_obj.attempts >= task_obj.max_attempts:
+            status, run_after = TaskStatus.FAILED, task_obj.run_after
+        else:
+            status, run_after = TaskStatus.PENDING, now() + timedelta(seconds=retry_delay(task_obj.attempts))
+        Task.objects.filter(id=task_obj.id).update(
+            status=status, run_after=run_after, locked_at=None, last_error=traceback.format_exc(),
+        )
+        return False
+    Task.objects.filter(id=task_obj.id).delete()
+    return True
+
+
+def work(batch_size=10, poll_interval=1.0, once=False):
+    """Processes tasks until interrupted, or until the queue is empty when ``once`` is set."""
+    while True:
+        tasks = claim_tasks(batch_size)
+        for task_obj in tasks:
+            run_task(task_obj)
+        if not tasks:
+            if once:
+                return
+            time.sleep(poll_interval)
+
+
+# -----------------------------------------------------------------------------
+# Tasks
+# -----------------------------------------------------------------------------
+
+@task
+def extract_image_metadata(image_id):
+    """Reads the dimensions, format, perceptual hash and colours of an uploaded image file."""
+    from .colors import index_image_colors
+    from .imaging import analyze_image, read_image_attributes, to_signed64
+    from .models import Image
+
+    image = Image.objects.filter(id=image_id).only('id', 'image_file').first()
+    if image is None:
+        return
+    image.image_file.open('rb')
+    try:
+        width, height, img_format = read_image_attributes(image.image_file)
+        image.image_file.seek(0)
+        phash, histogram, palette = analyze_image(image.image_file)
+        size = image.image_file.size
+    finally:
+        image.image_file.close()
+    Image.objects.filter(id=image_id).update(
+        width=width, height=height, format=img_format, size=size,
+        phash=to_signed64(phash), phash_updated_at=now(), dominant_colors=palette,
+    )
+    index_image_colors(image_id, histogram)
+
+
+@task
+def generate_image_renditions(image_id, force=False):
+    """Generates the resized copies used by the gallery grids."""
+    from .models import Image
+
+    image = Image.objects.filter(id=image_id).only('id', 'image_file', 'renditions').first()
+    if image is not None:
+        image.update_renditions(force=force)
+
+
+@task
+def refresh_trending_scores():
+    """Recomputes the trending scores and queues the next run."""
+    from .trending import update_trending_scores
+
+    update_trending_scores()
+    schedule('refresh_trending_scores', delay=getattr(settings, 'TRENDING_UPDATE_INTERVAL', 600))
+
+
+@task
+def check_comment_spam(comment_id):
+    """Runs a comment through Akismet and rejects it if it is flagged as spam."""
+    from .models import Comment, ModerationStatus, check_spam
+
+    comment = Comment.objects.filter(id=comment_id).only('id', 'content').first()
+    if comment is not None and check_spam(comment.content):
+        Comment.objects.filter(id=comment_id).update(
+            moderation_status=ModerationStatus.REJECTED, moderation_updated_at=now(),
+        )
+
+
+@task
+def renumber_album_images(album_id):
+    """Spreads an album's image ranks apart again once moves have used up the gaps."""
+    from .albumorder import renumber
+    from .models import Album
+
+    if Album.objects.filter(id=album_id).exists():
+        renumber(album_id)
+
+
+# Recurring tasks started by `run_workers`; each one queues its own next run.
+PERIODIC_TASKS = ['refresh_trending_scores']
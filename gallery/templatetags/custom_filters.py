@@ -16,4 +16,8 @@ def is_active(request_path, url_name):
 
 @register.filter(name='add_class')
 def add_class(field, css_class):
-    return field.as_widget(attrs={"class": css_class})
\ No newline at end of file
+    return field.as_widget(attrs={"class": css_class})
+
+@register.filter
+def srcset(image, fmt='jpeg'):
+    return image.srcset(fmt)
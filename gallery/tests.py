@@ -1,3 +1,1161 @@
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, User
+from datetime import timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+import os
+import random
+import threading
 
-# Create your tests here.
+import numpy as np
+from PIL import Image as PILImage
+
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db.models import F
+from django.utils import timezone
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from .models import (
+    Album, AlbumFavorite, AlbumImage, AlbumLike, Audience, Comment, Favorite, Follow, Like, ModerationHistory,
+    ModerationQueueItem, MediaBlob, ModerationStatus, Image, Report, Tag, Task, TaskStatus, blob_storage,
+    audience_for, privacy_filter, reconcile_counters,
+)
+from .albumorder import ORDER_GAP, append_image, move, reorder
+from .downloads import parse_range, serve_file
+from .follows import get_followed_ids
+from .colors import filter_by_color, index_image_colors, nearby_bins, parse_hex
+from .imaging import color_bin, color_descriptor, compute_dhash
+from .interaction_state import attach_interaction_state
+from .moderation import QUEUE_ORDERING, moderate, rebuild_queue
+from . import autocomplete, cards, similarity, tasks
+from .storage import ContentAddressedStorage, delete_blob, release_blob, retain_blob
+from .tagging import edit_image_tags, get_or_create_tags, normalize_tag_names, set_image_tags
+from .pagecache import page_key
+from .pagination import CursorPaginator, InvalidCursor
+from .trending import compute_scores, decay, score_events, update_trending_scores
+from .querycount import QueryRecorder, get_query_budget
+from .queryplans import check_plans, seed
+from .search import search
+from .viewcounts import ViewCounter
+from .visibility import VisibilityChecker
+
+
+# Views are counted in memory and flushed on a timer; keep the flush out of the measured requests.
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=3600, VIEW_COUNT_MAX_PENDING=10**6)
+class QueryBudgetTests(TestCase):
+    """
+    Requests each page with a few rows, then with many more, and checks that the view stays
+    within its ``QUERY_BUDGETS`` entry and that its query count does not grow with the rows:
+    a count that grows is an N+1 in the view or its template.
+    """
+
+    moderation_status = ModerationStatus.APPROVED
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='x')
+        self.viewer = User.objects.create_user('viewer', password='x')
+        self.staff = User.objects.create_user('staff', password='x', is_staff=True)
+        self.tag = Tag.objects.create(name='sky', moderation_status=ModerationStatus.APPROVED)
+        self.album = Album.objects.create(user=self.owner, name='Trips', moderation_status=ModerationStatus.APPROVED)
+        self.image = self.add_rows(3)[0]
+
+    def add_rows(self, count):
+        """Adds ``count`` images, each with its own album, commenter, tags, likes and reports."""
+        images = []
+        for _ in range(count):
+            n = Image.objects.count()
+            image = Image(user=self.owner, title=f'image {n}', image_file=f'image-{n}.jpg', moderation_status=self.moderation_status)
+            image.save()
+            commenter = User.objects.create_user(f'commenter{n}')
+            image.tags.add(self.tag, Tag.objects.create(name=f'tag{n}', moderation_status=ModerationStatus.APPROVED))
+            AlbumImage.objects.create(album=self.album, image=image, order=n)
+            album = Album.objects.create(user=self.owner, name=f'album {n}', moderation_status=ModerationStatus.APPROVED)
+            AlbumImage.objects.create(album=album, image=image)
+            Like.objects.create(user=self.viewer, image=image)
+            Favorite.objects.create(user=self.viewer, image=image)
+            # Comments pile up on the first image, whose detail page is measured.
+            comment = Comment.objects.create(image=getattr(self, 'image', image), user=commenter, content='Nice')
+            Report.objects.create(reported_by=commenter, image=image, report_type='SPAM')
+            Report.objects.create(reported_by=commenter, comment=comment, report_type='SPAM')
+            images.append(image)
+        return images
+
+    def count_queries(self, url, user=None):
+        for alias in ('default', 'pages'):
+            caches[alias].clear()
+        if user is None:
+            self.client.logout()
+        else:
+            self.client.force_login(user)
+        with QueryRecorder() as recorder:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return recorder
+
+    def assertWithinBudget(self, view_name, url, user=None):
+        budget = get_query_budget(view_name)
+        self.assertIsNotNone(budget, f'{view_name} has no query budget')
+        few = self.count_queries(url, user)
+        self.add_rows(10)
+        many = self.count_queries(url, user)
+        sql = '\n'.join(statement for statement, _ in many.queries)
+        self.assertLessEqual(many.count, budget, f'{view_name} ran {many.count} queries:\n{sql}')
+        self.assertEqual(few.count, many.count, f'{view_name} runs more queries with more rows:\n{sql}')
+
+    def test_gallery(self):
+        self.assertWithinBudget('gallery', reverse('gallery'), self.viewer)
+
+    def test_gallery_anonymous(self):
+        self.assertWithinBudget('gallery', reverse('gallery'))
+
+    def test_tag_gallery(self):
+        self.assertWithinBudget('tagged_images', reverse('tagged_images', args=[self.tag.id]), self.viewer)
+
+    def test_album_gallery(self):
+        self.assertWithinBudget('albums', reverse('albums'), self.viewer)
+
+    def test_tags(self):
+        self.assertWithinBudget('tags', reverse('tags'))
+
+    def test_search(self):
+        self.assertWithinBudget('search', reverse('search') + '?q=image', self.viewer)
+
+    def test_image_detail(self):
+        self.assertWithinBudget('image_detail', reverse('image_detail', args=[self.image.id]), self.viewer)
+
+    def test_album_detail(self):
+        self.assertWithinBudget('album_detail', reverse('album_detail', args=[self.album.id]), self.viewer)
+
+    def test_user_gallery(self):
+        self.assertWithinBudget('user_gallery', reverse('user_gallery', args=['owner']), self.viewer)
+
+    def test_user_profile(self):
+        self.assertWithinBudget('user_profile', reverse('user_profile', args=['owner']), self.viewer)
+
+    def test_profile(self):
+        self.assertWithinBudget('profile', reverse('profile'), self.owner)
+
+    def test_user_albums(self):
+        self.assertWithinBudget('user_albums', reverse('user_albums', args=['owner']), self.viewer)
+
+    def test_admin_pending_images(self):
+        self.moderation_status = ModerationStatus.PENDING
+        Image.objects.update(moderation_status=ModerationStatus.PENDING)
+        self.assertWithinBudget('admin_pending_images', reverse('admin_pending_images'), self.staff)
+
+    def test_admin_reported_images(self):
+        self.assertWithinBudget('admin_reported_images', reverse('admin_reported_images'), self.staff)
+
+    def test_admin_reported_comments(self):
+        self.assertWithinBudget('admin_reported_comments', reverse('admin_reported_comments'), self.staff)
+
+
+class QueryPlanTests(TestCase):
+    """Seeds a few thousand rows and checks, by EXPLAIN, that each view's main query reads through its index."""
+
+    def test_views_use_their_indexes(self):
+        fixture = seed(2000)
+        for plan, output, ok, _ in check_plans(fixture, repeat=1):
+            with self.subTest(plan.name):
+                self.assertTrue(ok, f'{plan.name} does not use {plan.index}:\n{output}')
+
+
+class BulkModerationTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.owner = User.objects.create_user('owner')
+        self.client.force_login(self.staff)
+
+    def moderate(self, **data):
+        with QueryRecorder() as recorder:
+            response = self.client.post(reverse('admin_bulk_moderate'), data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), recorder.count
+
+    def test_batch_cost_does_not_grow_with_its_size(self):
+        images = [Image.objects.create(user=self.owner, title=f'image {n}', image_file=f'{n}.jpg') for n in range(30)]
+        comments = [Comment.objects.create(image=images[0], user=self.owner, content='Hi') for _ in range(30)]
+        album = Album.objects.create(user=self.owner, name='Trips')
+
+        _, few = self.moderate(action='approve', images=[images[0].id], comments=[comments[0].id])
+        result, many = self.moderate(
+            action='approve', images=[image.id for image in images], comments=[comment.id for comment in comments],
+            albums=[album.id],
+        )
+        self.assertEqual(result['changed'], {'images': 29, 'comments': 29, 'albums': 1, 'reports': 0})
+        self.assertEqual(few + 2, many)  # plus the album SELECT and UPDATE
+        self.assertFalse(Image.objects.exclude(moderation_status=ModerationStatus.APPROVED).exists())
+        self.assertFalse(Image.objects.exclude(audience=Audience.PUBLIC).exists())
+        self.assertEqual(ModerationHistory.objects.filter(action='approved', moderator=self.staff).count(), 61)
+
+    def test_reject_and_resolve(self):
+        image = Image.objects.create(user=self.owner, title='image', image_file='x.jpg', moderation_status=ModerationStatus.APPROVED)
+        report = Report.objects.create(reported_by=self.owner, image=image, report_type='SPAM')
+
+        other = Report.objects.create(reported_by=self.owner, image=Image.objects.create(user=self.owner, title='other', image_file='y.jpg'), report_type='SPAM')
+        self.assertEqual(ModerationQueueItem.objects.count(), 2)
+
+        result, _ = self.moderate(action='reject', images=[image.id])
+        self.assertEqual((result['changed']['images'], result['changed']['reports']), (1, 1))
+        image.refresh_from_db()
+        self.assertEqual((image.moderation_status, image.audience, image.moderated_by), (ModerationStatus.REJECTED, Audience.HIDDEN, self.staff))
+        # Rejected content leaves the queue along with its reports.
+        self.assertEqual(Report.objects.get(pk=report.pk).status, 'RESOLVED')
+        self.assertEqual(list(ModerationQueueItem.objects.values_list('image', flat=True)), [other.image_id])
+
+        result, _ = self.moderate(action='resolve', reports=[other.id])
+        self.assertEqual(result['changed']['reports'], 1)
+        self.assertFalse(Report.objects.filter(status='PENDING').exists())
+        self.assertFalse(ModerationQueueItem.objects.exists())
+
+    def test_invalid_requests(self):
+        response = self.client.post(reverse('admin_bulk_moderate'), {'action': 'delete'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('admin_bulk_moderate'), {'action': 'approve', 'images': ['x']})
+        self.assertRedirects(response, reverse('admin_page'), fetch_redirect_response=False)
+
+
+class ModerationQueueTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.images = [Image.objects.create(user=self.owner, title=f'image {n}', image_file=f'{n}.jpg') for n in range(3)]
+
+    def report(self, image, report_type, reporter=None):
+        return Report.objects.create(reported_by=reporter or self.owner, image=image, report_type=report_type)
+
+    def test_aggregates_follow_reports(self):
+        first = self.report(self.images[0], 'SPAM')
+        self.report(self.images[0], 'ABUSE')
+        item = ModerationQueueItem.objects.get(image=self.images[0])
+        self.assertEqual((item.open_reports, item.spam_reports, item.abuse_reports, item.other_reports), (2, 1, 1, 0))
+        self.assertEqual(item.priority, 5.0)
+        self.assertEqual(item.first_reported_at, first.created_at)
+
+        first.status = 'RESOLVED'
+        first.save()
+        item.refresh_from_db()
+        self.assertEqual((item.open_reports, item.spam_reports, item.priority), (1, 0, 3.0))
+
+        Report.objects.filter(image=self.images[0]).delete()
+        self.assertFalse(ModerationQueueItem.objects.exists())
+
+    def test_queue_is_ordered_by_priority(self):
+        self.report(self.images[0], 'OTHER')
+        self.report(self.images[1], 'ABUSE')
+        self.report(self.images[2], 'OTHER')
+        self.report(self.images[2], 'OTHER')
+        # One abuse report outweighs two others; ties fall back to the latest report.
+        queue = ModerationQueueItem.objects.order_by(*QUEUE_ORDERING).values_list('image', flat=True)
+        self.assertEqual(list(queue), [self.images[1].id, self.images[2].id, self.images[0].id])
+
+    def test_resolving_reports_empties_the_queue(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        reports = [self.report(image, 'SPAM') for image in self.images]
+        self.client.force_login(staff)
+        self.client.post(reverse('admin_bulk_moderate'), {'action': 'resolve', 'reports': [reports[0].id]}, content_type='application/json')
+        self.assertEqual(set(ModerationQueueItem.objects.values_list('image', flat=True)), {self.images[1].id, self.images[2].id})
+
+        response = self.client.get(reverse('admin_reported_images'))
+        self.assertEqual([item.image for item in response.context['page_obj']], self.images[:0:-1])
+
+    def test_rebuild_matches_incremental_updates(self):
+        for image in self.images:
+            self.report(image, 'ABUSE')
+        self.report(self.images[0], 'OTHER')
+        before = list(ModerationQueueItem.objects.order_by('image').values('image', 'open_reports', 'priority'))
+        self.assertEqual(rebuild_queue(chunk_size=2), 3)
+        self.assertEqual(list(ModerationQueueItem.objects.order_by('image').values('image', 'open_reports', 'priority')), before)
+
+
+class AlbumOrderTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.album = Album.objects.create(user=self.owner, name='Trips')
+        self.images = []
+        self.add_images(5)
+
+    def add_images(self, count):
+        for _ in range(count):
+            n = len(self.images)
+            image = Image.objects.create(user=self.owner, title=f'image {n}', image_file=f'{n}.jpg')
+            append_image(self.album, image)
+            self.images.append(image)
+
+    def order(self):
+        return list(self.album.albumimage_set.order_by('order').values_list('image_id', flat=True))
+
+    def test_appended_images_are_spread_apart(self):
+        ranks = list(self.album.albumimage_set.order_by('order').values_list('order', flat=True))
+        self.assertEqual(ranks, [ORDER_GAP * n for n in range(1, 6)])
+
+    def test_move_cost_does_not_grow_with_the_album(self):
+        with QueryRecorder() as few:
+            move(self.album.id, self.images[4].id, after=self.images[0].id)
+        self.add_images(50)
+        with QueryRecorder() as many:
+            move(self.album.id, self.images[3].id, after=self.images[4].id)
+        self.assertEqual(few.count, many.count)
+        ids = [image.id for image in self.images]
+        self.assertEqual(self.order()[:5], [ids[0], ids[4], ids[3], ids[1], ids[2]])
+        move(self.album.id, ids[2])
+        self.assertEqual(self.order()[:2], [ids[2], ids[0]])
+
+    def test_move_renumbers_once_the_gap_is_used_up(self):
+        first, second = self.images[0].id, self.images[1].id
+        for image in self.images[2:] * 5:
+            move(self.album.id, image.id, after=first)
+        self.assertEqual(self.order()[0], first)
+        self.assertEqual(self.order()[-1], second)
+        ranks = list(self.album.albumimage_set.order_by('order').values_list('order', flat=True))
+        self.assertEqual(len(set(ranks)), len(ranks))
+
+    def test_move_queues_one_renumbering_per_album(self):
+        other = Album.objects.create(user=self.owner, name='Pets')
+        for image in self.images:
+            append_image(other, image)
+        for n, image in enumerate(self.images):
+            AlbumImage.objects.filter(image=image).update(order=ORDER_GAP + 3 * n)
+        for album in (self.album, other):
+            # Both moves leave one rank of room, so each asks for a renumbering.
+            move(album.id, self.images[4].id, after=self.images[0].id)
+            move(album.id, self.images[3].id, after=self.images[1].id)
+        queued = Task.objects.filter(name='renumber_album_images').values_list('payload', flat=True)
+        self.assertCountEqual(queued, [{'album_id': self.album.id}, {'album_id': other.id}])
+
+    def test_reorder_is_one_bulk_update(self):
+        self.add_images(50)
+        ids = [image.id for image in reversed(self.images)]
+        with QueryRecorder() as recorder:
+            self.assertEqual(reorder(self.album.id, ids), 54)  # the middle image keeps its rank
+        self.assertLessEqual(recorder.count, 5)  # savepoint, lock, read, update, release
+        self.assertEqual(self.order(), ids)
+
+    def test_endpoints_require_the_owner(self):
+        other = User.objects.create_user('other')
+        url = reverse('move_album_image', args=[self.album.id])
+        body = {'image_id': self.images[0].id, 'after': self.images[1].id}
+        self.client.force_login(other)
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 404)
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 200)
+        self.assertEqual(self.order()[:2], [self.images[1].id, self.images[0].id])
+
+        response = self.client.post(reverse('save_image_order', args=[self.album.id]), {'order': [self.images[4].id]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.order()[0], self.images[4].id)
+
+
+class TagSyncTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.image = Image.objects.create(user=self.owner, title='image', image_file='x.jpg')
+
+    def tag_names(self):
+        return sorted(self.image.tags.values_list('name', flat=True))
+
+    def test_names_are_normalized(self):
+        self.assertEqual(normalize_tag_names(['  Sky ', 'sky', 'blue \t sea', '', ' ']), ['Sky', 'blue sea'])
+        self.assertEqual(len(normalize_tag_names(['x' * 80])[0]), 50)
+
+    def test_existing_tags_are_matched_regardless_of_case(self):
+        sky = Tag.objects.create(name='Sky')
+        tags = get_or_create_tags(['sky', 'sea'])
+        self.assertEqual(tags[0], sky)
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_case_variants_cannot_be_inserted(self):
+        Tag.objects.create(name='Sky')
+        Tag.objects.bulk_create([Tag(name='SKY'), Tag(name='sea')], ignore_conflicts=True)
+        self.assertEqual(sorted(Tag.objects.values_list('name', flat=True)), ['Sky', 'sea'])
+
+    def test_sync_cost_does_not_grow_with_the_tags(self):
+        def edit(count, offset):
+            names = [f'tag {offset + n}' for n in range(count)]
+            with QueryRecorder() as recorder:
+                set_image_tags(self.image, names)
+            self.assertEqual(self.tag_names(), sorted(names))
+            return recorder.count
+
+        edit(3, 0)
+        self.assertEqual(edit(3, 50), edit(30, 100))  # both replace every tag
+        with QueryRecorder() as recorder:
+            self.assertEqual(set_image_tags(self.image, [f'TAG {100 + n}' for n in range(30)]), ([], []))
+        self.assertEqual(recorder.count, 1)
+
+    def test_new_tags_invalidate_the_cached_tag_page(self):
+        caches['pages'].clear()
+        self.assertNotContains(self.client.get(reverse('tags')), 'sunset')
+        with self.captureOnCommitCallbacks(execute=True):
+            set_image_tags(self.image, ['sunset'])
+        self.assertContains(self.client.get(reverse('tags')), 'sunset')
+
+    def test_edit_adds_and_removes(self):
+        set_image_tags(self.image, ['sky', 'sea'])
+        added, removed = edit_image_tags(self.image, add=['Sun', 'sky'], remove=['SEA', ''])
+        self.assertEqual(([tag.name for tag in added], [tag.name for tag in removed]), (['Sun'], ['sea']))
+        self.assertEqual(self.tag_names(), ['Sun', 'sky'])
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.image = Image.objects.create(user=self.owner, title='image', image_file='x.jpg')
+
+    def test_counters_follow_created_and_deleted_rows(self):
+        album = Album.objects.create(user=self.owner, name='Trips')
+        other = User.objects.create_user('other')
+        likes = [Like.objects.create(user=user, image=self.image) for user in (self.owner, other)]
+        Favorite.objects.create(user=other, image=self.image)
+        Comment.objects.create(image=self.image, user=other, content='Hi')
+        AlbumLike.objects.create(user=other, album=album)
+        AlbumFavorite.objects.create(user=other, album=album)
+        likes[0].delete()
+
+        image, album = Image.objects.get(), Album.objects.get()
+        self.assertEqual((image.like_count, image.favorite_count, image.comment_count), (1, 1, 1))
+        self.assertEqual((album.like_count, album.favorite_count), (1, 1))
+        self.assertEqual(list(reconcile_counters(dry_run=True)), [])
+
+    def test_unfilled_counter_is_not_decremented_below_zero(self):
+        like = Like.objects.create(user=self.owner, image=self.image)
+        Image.objects.update(like_count=0)  # as left by a newly added column
+        like.delete()
+        self.assertEqual(Image.objects.get().like_count, 0)
+
+    def test_reconcile_fills_counters(self):
+        Like.objects.create(user=self.owner, image=self.image)
+        Comment.objects.create(image=self.image, user=self.owner, content='Hi')
+        Image.objects.update(like_count=0, comment_count=0)
+        drifted = reconcile_counters()
+        self.assertEqual(drifted[0][1], {'like_count': (0, 1), 'comment_count': (0, 1)})
+        image = Image.objects.get()
+        self.assertEqual((image.like_count, image.comment_count), (1, 1))
+
+    def test_save_keeps_concurrent_counter_updates(self):
+        image = Image.objects.get()
+        Like.objects.create(user=self.owner, image=self.image)
+        Image.objects.update(views=F('views') + 5)
+        image.title = 'renamed'
+        with QueryRecorder() as recorder:
+            image.save()
+        self.assertTrue(recorder.queries[0][0].startswith('UPDATE'))  # no reload first
+        self.assertEqual((image.popularity_score, image.card_version), (7.0, 1))
+        stored = Image.objects.get()
+        self.assertEqual((stored.title, stored.like_count, stored.views), ('renamed', 1, 5))
+
+
+class BlobStorageTests(TestCase):
+    def setUp(self):
+        self.content = ContentFile(b'pixels', name='photo.jpg')
+        self.name = blob_storage.save('photo.jpg', self.content)
+        self.addCleanup(delete_blob, blob_storage, self.name)
+
+    def release(self, execute=True):
+        with self.captureOnCommitCallbacks(execute=execute) as callbacks:
+            release_blob(blob_storage, self.name)
+        return callbacks
+
+    def test_last_release_deletes_the_blob_and_its_renditions(self):
+        rendition = blob_storage.save(self.name.replace('.jpg', '_256w.webp'), ContentFile(b'small'))
+        retain_blob(self.name)
+        self.release()
+        self.assertFalse(blob_storage.exists(self.name))
+        self.assertFalse(blob_storage.exists(rendition))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_blob_retained_before_the_deletion_runs_is_kept(self):
+        retain_blob(self.name)
+        callbacks = self.release(execute=False)
+        retain_blob(self.name)  # a new upload of the same bytes
+        for callback in callbacks:
+            callback()
+        self.assertTrue(blob_storage.exists(self.name))
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+    def test_upload_restores_a_blob_deleted_under_it(self):
+        owner = User.objects.create_user('owner')
+        save = ContentAddressedStorage.save
+        released = []
+
+        def save_then_release(storage, name, content, max_length=None):
+            # The upload finds the existing blob, then a concurrent release deletes it.
+            name = save(storage, name, content, max_length)
+            if not released:
+                released.append(name)
+                storage.delete(name)
+            return name
+
+        with mock.patch.object(ContentAddressedStorage, 'save', save_then_release):
+            image = Image.objects.create(user=owner, title='image', image_file=ContentFile(b'pixels', name='again.jpg'))
+        self.assertEqual(image.image_file.name, self.name)
+        with blob_storage.open(self.name) as stored:
+            self.assertEqual(stored.read(), b'pixels')
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+    def test_identical_uploads_share_one_blob(self):
+        owner = User.objects.create_user('owner')
+        first, second = [
+            Image.objects.create(user=owner, title=f'image {n}', image_file=ContentFile(b'pixels', name=f'upload{n}.jpg'))
+            for n in range(2)
+        ]
+        self.assertEqual(first.image_file.name, self.name)
+        self.assertEqual(second.image_file.name, self.name)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(blob_storage.exists(self.name))
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+    def test_unrelated_files_next_to_a_blob_are_kept(self):
+        self.assertEqual(blob_storage.get_available_name(self.name), self.name)
+        self.assertEqual(blob_storage.save(self.name, ContentFile(b'pixels')), self.name)
+        neighbour = blob_storage.save(self.name.replace('.jpg', '_AbC123x.jpg'), ContentFile(b'other'))
+        self.addCleanup(blob_storage.delete, neighbour)
+        retain_blob(self.name)
+        self.release()
+        self.assertTrue(blob_storage.exists(neighbour))
+
+
+class SimilarityIndexTests(TestCase):
+    def setUp(self):
+        similarity._index = None
+        self.addCleanup(setattr, similarity, '_index', None)
+        owner = User.objects.create_user('owner')
+        self.old, self.new = [Image.objects.create(user=owner, title=f'image {n}', image_file=f'{n}.jpg') for n in range(2)]
+
+    def hash(self, image, phash):
+        Image.objects.filter(id=image.id).update(phash=phash, phash_updated_at=timezone.now())
+
+    def test_images_hashed_late_are_found(self):
+        self.hash(self.new, 0b1111)
+        self.assertEqual(similarity.find_similar_ids([self.new.id])[self.new.id], [])
+        self.hash(self.old, 0b1110)  # a lower id, hashed after the index was built
+        self.assertEqual(similarity.find_similar_ids([self.new.id])[self.new.id], [(1, self.old.id)])
+
+    def test_tree_search_matches_a_linear_scan(self):
+        rng = random.Random(6)
+        values = [rng.getrandbits(64) for _ in range(300)]
+        tree = similarity.BKTree()
+        for item_id, value in enumerate(values):
+            tree.add(value, item_id)
+        for probe in values[:20]:
+            distances = [(similarity.hamming(probe, value), item_id) for item_id, value in enumerate(values)]
+            expected = sorted(pair for pair in distances if pair[0] <= 24)
+            self.assertEqual(sorted(tree.search(probe, 24)), expected)
+
+    def test_resized_copies_hash_alike(self):
+        picture = PILImage.effect_mandelbrot((300, 200), (-2, -1, 1, 1), 50).convert('RGB')
+        copies = []
+        for size in ((300, 200), (90, 60)):
+            buffer = BytesIO()
+            picture.resize(size).save(buffer, 'JPEG')
+            copies.append(compute_dhash(BytesIO(buffer.getvalue())))
+        self.assertLessEqual(similarity.hamming(*copies), 4)
+
+    def test_rehashed_images_rebuild_the_index(self):
+        self.hash(self.new, 0b1111)
+        self.hash(self.old, 0b1110)
+        similarity.get_index()
+        self.hash(self.old, -1)
+        self.assertEqual(similarity.find_similar_ids([self.new.id])[self.new.id], [])
+
+
+class PageKeyTests(TestCase):
+    def test_key_covers_path_query_and_scopes(self):
+        factory = RequestFactory()
+        key = lambda path, scopes=('tag:1',): page_key('tagged_images', scopes, factory.get(path), ['7'])  # noqa: E731
+        self.assertNotEqual(key('/gallery/tag/1/'), key('/gallery/tag/2/'))
+        self.assertNotEqual(key('/gallery/tag/1/'), key('/gallery/tag/1/?cursor=x'))
+        self.assertNotEqual(key('/gallery/tag/1/'), key('/gallery/tag/1/', ('tag:2',)))
+        self.assertEqual(key('/gallery/tag/1/?a=1&b=2'), key('/gallery/tag/1/?b=2&a=1'))
+
+
+class TrendingTests(TestCase):
+    def test_events_halve_every_half_life(self):
+        at = 1_000_000.0
+        hour = 3600.0
+        weights = decay(np.array([at, at - 48 * hour, at - 96 * hour, at + hour]), at, 48)
+        self.assertEqual(list(weights), [1.0, 0.5, 0.25, 1.0])  # future events do not grow
+        # Two fresh likes on image 2, one a half-life old on image 5; image 9 is not a candidate.
+        scores = score_events(
+            np.array([2, 5, 7]), np.array([2, 5, 2, 9]), np.array([at, at - 48 * hour, at, at]), 3.0, at, 48,
+        )
+        self.assertEqual(list(scores), [6.0, 1.5, 0.0])
+
+    def test_only_rows_whose_score_can_change_are_read(self):
+        owner = User.objects.create_user('owner')
+        old = timezone.now() - timedelta(days=700)
+        liked, cooling, idle, viewed, forgotten = [
+            Image.objects.create(user=owner, title=title, image_file=f'{title}.jpg', uploaded_at=old)
+            for title in ('liked', 'cooling', 'idle', 'viewed', 'forgotten')
+        ]
+        Like.objects.create(user=owner, image=liked)
+        Image.objects.filter(id=cooling.id).update(trending_score=5.0)
+        Image.objects.filter(id=viewed.id).update(views=100, uploaded_at=timezone.now())
+        Image.objects.filter(id=forgotten.id).update(views=100)
+
+        ids, scores, _ = compute_scores(Image, 'uploaded_at', {'like': (Like, 'image_id', 'liked_at')})
+        self.assertEqual(list(ids), [liked.id, cooling.id, viewed.id])
+
+        update_trending_scores()
+        scores = dict(Image.objects.values_list('title', 'trending_score'))
+        self.assertEqual(scores['cooling'], 0.0)
+        self.assertGreater(scores['liked'], 0.0)
+        self.assertGreater(scores['viewed'], 0.0)
+
+
+class TagIndexTests(TestCase):
+    def setUp(self):
+        autocomplete._index = autocomplete.TagIndex()
+        autocomplete._index.put(1, 'sky', 3)
+        autocomplete._index.built_at = float('-inf')  # due for a rebuild
+        self.addCleanup(setattr, autocomplete, '_index', None)
+
+    def test_prefix_lookups_rank_by_usage(self):
+        index = autocomplete.TagIndex()
+        for tag_id, name, usage in [(1, 'Sky', 3), (2, 'skyline', 7), (3, 'sea', 9), (4, 'Skate', 3)]:
+            index.put(tag_id, name, usage)
+        self.assertEqual(index.complete('SK'), [(2, 'skyline', 7), (4, 'Skate', 3), (1, 'Sky', 3)])
+        self.assertEqual(index.complete('sky', limit=1), [(2, 'skyline', 7)])
+        index.count({1: 10})  # memoized suggestions are dropped with the counts
+        self.assertEqual(index.complete('sk')[0], (1, 'Sky', 13))
+        index.put(1, 'Blue sky')
+        self.assertEqual(index.complete('b'), [(1, 'Blue sky', 13)])
+        index.remove(2)
+        self.assertEqual(index.complete('sk'), [(4, 'Skate', 3)])
+
+    def test_lookups_are_not_blocked_by_a_rebuild(self):
+        loading, release = threading.Event(), threading.Event()
+
+        def slow_load(index):
+            loading.set()
+            release.wait(5)
+            index.put(2, 'sea', 1)
+
+        with mock.patch.object(autocomplete.TagIndex, 'load', slow_load):
+            rebuild = threading.Thread(target=autocomplete.get_tag_index)
+            rebuild.start()
+            self.assertTrue(loading.wait(5))
+            # The old index answers while the new one loads, and changes made meanwhile carry over.
+            self.assertEqual(autocomplete.complete_tags('s'), [(1, 'sky', 3)])
+            with self.captureOnCommitCallbacks(execute=True):
+                autocomplete._apply('put', 3, 'sun', 0)
+            release.set()
+            rebuild.join(5)
+        self.assertEqual([name for _, name, _ in autocomplete.complete_tags('s')], ['sea', 'sun'])
+
+    def test_cold_start_keeps_changes_made_during_the_first_build(self):
+        autocomplete._index = None
+        loading, release = threading.Event(), threading.Event()
+
+        def load(index):
+            if not loading.is_set():
+                loading.set()
+                release.wait(5)
+            index.put(2, 'sea', 1)
+
+        with mock.patch.object(autocomplete.TagIndex, 'load', load):
+            first = threading.Thread(target=autocomplete.get_tag_index)
+            first.start()
+            self.assertTrue(loading.wait(5))
+            # A second caller loads an index of its own rather than restarting the build.
+            self.assertEqual(autocomplete.complete_tags('s'), [(2, 'sea', 1)])
+            with self.captureOnCommitCallbacks(execute=True):
+                autocomplete._apply('put', 3, 'sun', 0)
+            release.set()
+            first.join(5)
+            self.assertEqual([name for _, name, _ in autocomplete.complete_tags('s')], ['sea', 'sun'])
+
+
+class DownloadTests(TestCase):
+    def setUp(self):
+        name = blob_storage.save('download.bin', ContentFile(b'0123456789'))
+        self.addCleanup(blob_storage.delete, name)
+        self.file = SimpleNamespace(storage=blob_storage, name=name)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        return serve_file(self.factory.get('/download', headers=headers), self.file, 'download.bin')
+
+    def test_not_modified_carries_the_validators(self):
+        etag = self.get()['ETag']
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('Last-Modified', response)
+
+    def test_inverted_range_serves_the_whole_file(self):
+        self.assertIsNone(parse_range('bytes=5-3', 10))
+        response = self.get(range='bytes=5-3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_range_past_the_end_is_unsatisfiable(self):
+        response = self.get(range='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=2-4', 10), (2, 4))
+        self.assertEqual(parse_range('bytes=7-', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-30', 10), (0, 9))
+        self.assertEqual(parse_range('bytes=8-100', 10), (8, 9))
+        for header in (None, '', 'bytes=-', 'bytes=0-1,4-5', 'items=0-1'):
+            self.assertIsNone(parse_range(header, 10))
+
+    def test_partial_content(self):
+        response = self.get(range='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+
+    def test_range_is_ignored_when_if_range_is_stale(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(range='bytes=2-4', if_range=etag).status_code, 206)
+        response = self.get(range='bytes=2-4', if_range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    @override_settings(DOWNLOAD_OFFLOAD='x-accel-redirect', DOWNLOAD_ACCEL_REDIRECT_PREFIX='/protected/')
+    def test_offloaded_downloads_carry_no_body(self):
+        response = self.get(range='bytes=2-4')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.file.name)
+        self.assertEqual(response.content, b'')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+
+def jpeg_file(width, height, color=(200, 40, 40), name='photo.jpg'):
+    buffer = BytesIO()
+    PILImage.new('RGB', (width, height), color).save(buffer, 'JPEG')
+    return ContentFile(buffer.getvalue(), name=name)
+
+
+class RenditionTests(TestCase):
+    def test_renditions_never_upscale(self):
+        owner = User.objects.create_user('owner')
+        image = Image.objects.create(user=owner, title='image', image_file=jpeg_file(600, 300))
+        self.assertTrue(Task.objects.filter(name='generate_image_renditions', payload={'image_id': image.id}).exists())
+        image.update_renditions()
+        self.addCleanup(delete_blob, blob_storage, image.image_file.name, image.renditions)
+
+        self.assertEqual({fmt: sorted(names, key=int) for fmt, names in image.renditions.items()}, {
+            'webp': ['256', '512', '600'], 'jpeg': ['256', '512', '600'],
+        })
+        with PILImage.open(blob_storage.path(image.renditions['webp']['256'])) as small:
+            self.assertEqual(small.size, (256, 128))
+        self.assertEqual(Image.objects.get(pk=image.pk).renditions, image.renditions)
+        self.assertEqual([entry.split()[1] for entry in image.srcset('webp').split(', ')], ['256w', '512w', '600w'])
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        registry = {'record': lambda **payload: self.calls.append(payload), 'fail': self.fail_task}
+        patcher = mock.patch.dict(tasks._registry, registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail_task(self):
+        raise RuntimeError('boom')
+
+    def test_worker_runs_due_tasks_and_deletes_them(self):
+        tasks.enqueue('record', n=1)
+        later = tasks.enqueue('record', delay=60, n=2)
+        tasks.work(once=True)
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertEqual(list(Task.objects.all()), [later])
+        with self.assertRaises(KeyError):
+            tasks.enqueue('missing')
+
+    def test_failures_back_off_and_give_up(self):
+        task_obj = tasks.enqueue('fail', max_attempts=2)
+        with self.assertLogs('gallery.tasks', 'ERROR'):
+            tasks.work(once=True)
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.attempts), (TaskStatus.PENDING, 1))
+        self.assertGreater(task_obj.run_after, timezone.now())
+        self.assertIn('RuntimeError: boom', task_obj.last_error)
+
+        Task.objects.filter(pk=task_obj.pk).update(run_after=timezone.now())
+        with self.assertLogs('gallery.tasks', 'ERROR'):
+            tasks.work(once=True)
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.attempts), (TaskStatus.FAILED, 2))
+
+    @override_settings(TASK_LOCK_TIMEOUT=60)
+    def test_tasks_of_a_dead_worker_are_reclaimed(self):
+        task_obj = tasks.enqueue('record')
+        self.assertEqual(tasks.claim_tasks(10), [task_obj])
+        self.assertEqual(tasks.claim_tasks(10), [])
+        Task.objects.filter(pk=task_obj.pk).update(locked_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(tasks.claim_tasks(10), [task_obj])
+
+    @override_settings(TASKS_ALWAYS_EAGER=True)
+    def test_eager_tasks_run_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.enqueue('record', n=1)
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertFalse(Task.objects.exists())
+
+
+class ImageAttributeCommandTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.images = [
+            Image.objects.create(user=owner, title=f'image {n}', image_file=jpeg_file(40 + n, 30, name=f'{n}.jpg'))
+            for n in range(3)
+        ]
+        for image in self.images:
+            self.addCleanup(delete_blob, blob_storage, image.image_file.name)
+
+    def update(self, *args):
+        out = StringIO()
+        call_command('update_image_attributes', '--workers', '1', '--chunk-size', '2', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_fills_missing_attributes_then_skips_current_rows(self):
+        Image.objects.update(width=None, height=None, format=None, size=None)
+        self.assertIn('updated 3', self.update())
+        rows = Image.objects.order_by('id').values_list('width', 'height', 'format')
+        self.assertEqual(list(rows), [(40, 30, 'JPEG'), (41, 30, 'JPEG'), (42, 30, 'JPEG')])
+        self.assertIn('updated 0', self.update())
+
+        Image.objects.filter(pk=self.images[2].pk).update(size=1)  # stale since the file changed
+        self.assertIn('updated 1', self.update())
+
+    def test_resumes_after_the_checkpoint(self):
+        Image.objects.update(width=None)
+        checkpoint = os.path.join(blob_storage.location, 'attributes.checkpoint')
+        with open(checkpoint, 'w') as f:
+            f.write(str(self.images[0].id))
+        self.update('--checkpoint', checkpoint, '--missing-only')
+        self.assertEqual(list(Image.objects.order_by('id').values_list('width', flat=True)), [None, 41, 42])
+        self.assertFalse(os.path.exists(checkpoint))
+
+
+class ColorSearchTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.red, self.speck, self.blue = [
+            Image.objects.create(user=owner, title=title, image_file=f'{title}.jpg') for title in ('red', 'speck', 'blue')
+        ]
+
+    def index(self, image, red_share):
+        picture = PILImage.new('RGB', (100, 100), (20, 40, 230))
+        picture.paste((250, 10, 10), (0, 0, 100, red_share))
+        histogram, palette = color_descriptor(picture)
+        index_image_colors(image.id, histogram)
+        return palette
+
+    def test_descriptor_reports_the_main_colours(self):
+        palette = self.index(self.red, 75)
+        (red, red_weight), (blue, blue_weight) = palette[:2]
+        self.assertAlmostEqual(red_weight, 0.75, delta=0.02)
+        self.assertAlmostEqual(blue_weight, 0.25, delta=0.02)
+        self.assertEqual(color_bin(*parse_hex(red)), color_bin(250, 10, 10))
+        self.assertEqual(color_bin(*parse_hex(blue)), color_bin(20, 40, 230))
+
+    def test_images_below_the_threshold_are_left_out(self):
+        self.index(self.red, 60)
+        self.index(self.speck, 3)  # 3% of red pixels is not enough to match
+        self.index(self.blue, 0)
+        found = filter_by_color(Image.objects.all(), parse_hex('#ff0000')).order_by('-color_score')
+        self.assertEqual(list(found), [self.red])
+        closeness = dict(nearby_bins((255, 0, 0)))[color_bin(250, 10, 10)]
+        self.assertAlmostEqual(found[0].color_score, 0.6 * closeness, delta=0.02)
+        found = filter_by_color(Image.objects.all(), (255, 0, 0), min_score=0.01).order_by('-color_score')
+        self.assertEqual(list(found), [self.red, self.speck])
+        self.assertIsNone(parse_hex('red'))
+
+
+class CursorPaginatorTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        uploaded_at = timezone.now()
+        self.images = [
+            Image.objects.create(user=owner, title=f'image {n}', image_file=f'{n}.jpg', uploaded_at=uploaded_at)
+            for n in range(7)
+        ]
+        # Ties on uploaded_at are broken by id, newest first.
+        self.paginator = CursorPaginator(Image.objects.all(), 3, ['-uploaded_at', '-id'])
+        self.expected = self.images[::-1]
+
+    def test_next_and_previous_tokens_walk_the_pages(self):
+        first = self.paginator.get_page()
+        self.assertEqual(list(first), self.expected[:3])
+        self.assertFalse(first.has_previous())
+        second = self.paginator.get_page(first.next_cursor)
+        self.assertEqual(list(second), self.expected[3:6])
+        last = self.paginator.get_page(second.next_cursor)
+        self.assertEqual(list(last), self.expected[6:])
+        self.assertIsNone(last.next_cursor)
+
+        back = self.paginator.get_page(last.previous_cursor)
+        self.assertEqual(list(back), self.expected[3:6])
+        self.assertTrue(back.has_next())
+        self.assertEqual(list(self.paginator.get_page(back.previous_cursor)), self.expected[:3])
+
+    def test_bad_tokens_give_the_first_page(self):
+        wrong_arity = CursorPaginator(Image.objects.all(), 3, ['-id']).encode_cursor(self.images[3], reverse=False)
+        for cursor in ('garbage', 'e30', wrong_arity):
+            with self.assertRaises(InvalidCursor):
+                self.paginator.decode_cursor(cursor)
+            page = self.paginator.get_page(cursor)
+            self.assertEqual(list(page), self.expected[:3])
+            self.assertFalse(page.has_previous())
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=3600, VIEW_COUNT_MAX_PENDING=1000)
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.images = [Image.objects.create(user=owner, title=f'image {n}', image_file=f'{n}.jpg') for n in range(3)]
+        self.album = Album.objects.create(user=owner, name='Trips')
+        self.counter = ViewCounter()
+        patcher = mock.patch.object(ViewCounter, '_start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def views(self):
+        return list(Image.objects.order_by('id').values_list('views', flat=True)) + [Album.objects.get().views]
+
+    def test_flush_groups_rows_by_increment(self):
+        for obj in (*self.images, self.images[0], self.images[1], self.album):
+            self.counter.record(obj)
+        self.assertEqual(self.views(), [0, 0, 0, 0])
+        with QueryRecorder() as recorder:
+            self.assertEqual(self.counter.flush(), 6)
+        updates = [sql for sql, *_ in recorder.queries if sql.startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)  # images seen twice, the image seen once, the album
+        self.assertEqual(self.views(), [2, 2, 1, 1])
+        self.assertEqual(self.counter.flush(), 0)
+
+    def test_failed_flush_requeues_the_views(self):
+        self.counter.record(self.images[0])
+        with mock.patch('django.db.models.QuerySet.update', side_effect=RuntimeError('db down')):
+            with self.assertLogs('gallery.viewcounts', 'ERROR'):
+                self.assertEqual(self.counter.flush(), 0)
+        self.counter.record(self.images[0])
+        self.assertEqual(self.counter.flush(), 2)
+        self.assertEqual(self.views(), [2, 0, 0, 0])
+
+    @override_settings(VIEW_COUNT_MAX_PENDING=2)
+    def test_full_buffer_is_flushed_on_record(self):
+        self.counter.record(self.images[0])
+        self.assertEqual(self.views(), [0, 0, 0, 0])
+        self.counter.record(self.images[1])
+        self.assertEqual(self.views(), [1, 1, 0, 0])
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.in_title = Image.objects.create(user=owner, title='Sunset over the bay', image_file='1.jpg')
+        self.in_description = Image.objects.create(user=owner, title='Evening', description='a sunset', image_file='2.jpg')
+        self.unrelated = Image.objects.create(user=owner, title='Forest', image_file='3.jpg')
+
+    def search(self, query):
+        return list(search(Image.objects.all(), query).order_by('-search_rank', 'id'))
+
+    def test_matches_are_ranked_by_field(self):
+        self.assertEqual(self.search('sunset'), [self.in_title, self.in_description])
+        self.assertEqual(self.search('suns'), [self.in_title, self.in_description])  # word prefixes match
+        self.assertEqual(self.search('sunset bay'), [self.in_title])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_tag_renames_and_deletes_reach_the_index(self):
+        tag = Tag.objects.create(name='trees')
+        self.unrelated.tags.add(tag)
+        self.assertEqual(self.search('trees'), [self.unrelated])
+        tag.name = 'woodland'
+        tag.save()
+        self.assertEqual(self.search('trees'), [])
+        self.assertEqual(self.search('woodland'), [self.unrelated])
+        tag.delete()
+        self.assertEqual(self.search('woodland'), [])
+        self.unrelated.delete()
+        self.assertEqual(self.search('forest'), [])
+
+
+class VisibilityCheckerTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.owner = User.objects.create_user('owner')
+        self.follower = User.objects.create_user('follower')
+        self.member = User.objects.create_user('member')
+        Follow.objects.create(follower=self.follower, followed=self.owner)
+        self.images = {
+            privacy: Image.objects.create(
+                user=self.owner, title=privacy, image_file=f'{privacy}.jpg', privacy=privacy,
+                moderation_status=ModerationStatus.APPROVED,
+            )
+            for privacy in ('public', 'users', 'followers', 'private')
+        }
+        self.images['pending'] = Image.objects.create(user=self.owner, title='pending', image_file='pending.jpg')
+
+    def visible(self, viewer):
+        checker = VisibilityChecker(viewer)
+        visible = checker.check_many(list(self.images.values()))
+        return {name for name, image in self.images.items() if visible[image.pk]}
+
+    def test_each_audience_sees_its_images(self):
+        everything = set(self.images)
+        self.assertEqual(self.visible(AnonymousUser()), {'public'})
+        self.assertEqual(self.visible(self.member), {'public', 'users'})
+        self.assertEqual(self.visible(self.follower), {'public', 'users', 'followers'})
+        self.assertEqual(self.visible(self.owner), everything)
+        self.assertEqual(self.visible(User.objects.create_user('staff', is_staff=True)), everything)
+
+    def test_follow_set_is_read_once_and_kept_in_the_cache(self):
+        images = list(Image.objects.filter(privacy='followers')) * 3
+        with self.assertNumQueries(1):
+            VisibilityChecker(self.follower).visible(images)
+        with self.assertNumQueries(0):
+            self.assertEqual(VisibilityChecker(self.follower).visible(images), images)
+        with self.assertRaises(PermissionDenied):
+            VisibilityChecker(self.member).require(images[0])
+
+
+class FollowCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.follower, self.first, self.second = [User.objects.create_user(name) for name in ('follower', 'first', 'second')]
+
+    def test_follows_drop_the_cached_set_on_commit(self):
+        self.assertEqual(list(get_followed_ids(self.follower.id)), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            follow = Follow.objects.create(follower=self.follower, followed=self.second)
+            Follow.objects.create(follower=self.follower, followed=self.first)
+            self.assertEqual(list(get_followed_ids(self.follower.id)), [])  # not dropped before commit
+        self.assertEqual(list(get_followed_ids(self.follower.id)), sorted([self.first.id, self.second.id]))
+        with self.assertNumQueries(0):
+            get_followed_ids(self.follower.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        self.assertEqual(list(get_followed_ids(self.follower.id)), [self.first.id])
+
+
+class AudienceTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.image = Image.objects.create(user=self.owner, title='image', image_file='x.jpg')
+
+    def audience(self):
+        return Image.objects.values_list('audience', flat=True).get(pk=self.image.pk)
+
+    def test_audience_follows_privacy_and_moderation(self):
+        self.assertEqual(self.audience(), Audience.HIDDEN)  # pending review
+        moderate(User.objects.create_user('staff', is_staff=True), 'approve', images=[self.image.pk])
+        self.assertEqual(self.audience(), Audience.PUBLIC)
+        self.image.refresh_from_db()
+        self.image.privacy = 'users'
+        self.image.save()
+        self.assertEqual(self.audience(), Audience.MEMBERS)
+        self.assertEqual(list(Image.objects.filter(privacy_filter(AnonymousUser()))), [])
+        self.assertEqual(list(Image.objects.filter(privacy_filter(self.owner))), [self.image])
+
+    def test_sql_expression_matches_audience_for(self):
+        for privacy in ('public', 'users', 'followers', 'private'):
+            for status in ModerationStatus.values:
+                expected = audience_for(privacy, status)
+                stale = (expected + 1) % len(Audience)
+                Image.objects.filter(pk=self.image.pk).update(privacy=privacy, moderation_status=status, audience=stale)
+                call_command('refresh_audiences', stdout=StringIO())
+                self.assertEqual(self.audience(), expected, (privacy, status))
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        self.owner = User.objects.create_user('owner')
+        self.url = reverse('gallery')
+        self.publish('Sunset')
+
+    def publish(self, title, **fields):
+        fields = {'moderation_status': ModerationStatus.APPROVED, **fields}
+        with self.captureOnCommitCallbacks(execute=True):
+            return Image.objects.create(user=self.owner, title=title, image_file=f'{title}.jpg', **fields)
+
+    def test_anonymous_pages_are_reused_until_a_public_image_changes(self):
+        self.assertContains(self.client.get(self.url), 'Sunset')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(self.url), 'Sunset')
+
+        self.publish('Hidden', privacy='private')
+        with self.assertNumQueries(0):
+            self.client.get(self.url)  # nothing anonymous visitors see has changed
+
+        harbour = self.publish('Harbour')
+        self.assertContains(self.client.get(self.url), 'Harbour')
+        with self.captureOnCommitCallbacks(execute=True):
+            harbour.privacy = 'private'
+            harbour.save()
+        self.assertNotContains(self.client.get(self.url), 'Harbour')
+
+    def test_signed_in_visitors_are_not_served_cached_pages(self):
+        self.client.get(self.url)
+        self.publish('Mine', privacy='private')
+        self.client.force_login(self.owner)
+        self.assertContains(self.client.get(self.url), 'Mine')
+
+
+class CardCacheTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        owner = User.objects.create_user('owner')
+        self.images = [Image.objects.create(user=owner, title=f'image {n}', image_file=f'{n}.jpg') for n in range(3)]
+
+    def render(self, images):
+        with mock.patch('gallery.cards.render_to_string', wraps=cards.render_to_string) as render:
+            html = cards.render_cards(images)
+        return html, render.call_count
+
+    def test_cards_are_rendered_once_and_overlaid_per_viewer(self):
+        _, rendered = self.render(self.images)
+        self.assertEqual(rendered, 3)
+        self.images[0].user_has_liked = True
+        html, rendered = self.render(self.images)
+        self.assertEqual(rendered, 0)
+        self.assertIn('fas fa-thumbs-up', html[0])
+        self.assertIn('far fa-thumbs-up', html[1])
+        self.assertNotIn('<!--card:', ''.join(html))
+
+    def test_saving_an_image_renders_its_card_again(self):
+        self.render(self.images)
+        self.images[1].title = 'renamed'
+        self.images[1].save()
+        html, rendered = self.render(self.images)
+        self.assertEqual(rendered, 1)
+        self.assertIn('renamed', html[1])
+
+
+class InteractionStateTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user('viewer')
+        self.images = [Image.objects.create(user=self.viewer, title=f'image {n}', image_file=f'{n}.jpg') for n in range(4)]
+        Like.objects.create(user=self.viewer, image=self.images[0])
+        Favorite.objects.create(user=self.viewer, image=self.images[1])
+        Like.objects.create(user=User.objects.create_user('other'), image=self.images[2])
+
+    def state(self, images):
+        return [(image.user_has_liked, image.user_has_favorited) for image in images]
+
+    def test_state_is_read_with_one_query_per_relation(self):
+        page = list(Image.objects.order_by('id')[:3])
+        with self.assertNumQueries(2):
+            images = attach_interaction_state(page, self.viewer)
+        self.assertEqual(self.state(images), [(True, False), (False, True), (False, False)])
+
+    def test_anonymous_viewers_and_empty_pages_cost_nothing(self):
+        with self.assertNumQueries(0):
+            images = attach_interaction_state(self.images, AnonymousUser())
+            self.assertEqual(attach_interaction_state([], self.viewer), [])
+        self.assertEqual(self.state(images), [(False, False)] * 4)
@@ -0,0 +1,122 @@
+import math
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils.timezone import now
+
+# Points an event is worth at the moment it happens, before decay; TRENDING_WEIGHTS overrides them.
+DEFAULT_WEIGHTS = {'like': 3.0, 'favorite': 5.0, 'comment': 2.0, 'view': 0.1}
+
+# Scores below this are stored as zero so that rows which stopped trending are not rewritten on every run.
+MIN_SCORE = 1e-3
+
+
+def trending_weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'TRENDING_WEIGHTS', {})}
+
+
+def decay(timestamps, at, half_life):
+    """Returns the weight left after exponential decay for each POSIX timestamp, as seen from ``at``."""
+    ages = np.maximum(at - timestamps, 0.0) / 3600.0
+    return np.exp2(-ages / half_life)
+
+
+def _as_arrays(rows, width):
+    """Converts ``(id, datetime, ...)`` rows into an int64 id array and float64 columns."""
+    rows = list(rows)
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    times = np.fromiter((row[1].timestamp() for row in rows), dtype=np.float64, count=len(rows))
+    extra = [np.fromiter((row[i] for row in rows), dtype=np.float64, count=len(rows)) for i in range(2, width)]
+    return ids, times, extra
+
+
+def score_events(target_ids, event_ids, event_times, weight, at, half_life):
+    """Sums the decayed weight of every event onto its target, in the order of the sorted ``target_ids``."""
+    positions = np.searchsorted(target_ids, event_ids)
+    # Events may refer to rows created after the targets were read.
+    known = (positions < len(target_ids)) & (target_ids[np.minimum(positions, len(target_ids) - 1)] == event_ids)
+    return np.bincount(
+        positions[known],
+        weights=weight * decay(event_times[known], at, half_life),
+        minlength=len(target_ids),
+    )
+
+
+def candidates(model, created_field, events, since, at, half_life, view_weight):
+    """
+    Returns the filter matching the rows of ``model`` whose score can be non-zero or can
+    change: rows with events in the window, rows with a stored score to decay, and rows
+    young enough for their views alone to reach ``MIN_SCORE``.
+    """
+    matched = Q(trending_score__gt=0)
+    for event_model, attname, time_field in events.values():
+        matched |= Q(id__in=event_model.objects.filter(**{f'{time_field}__gte': since}).values(attname))
+    most_views = model.objects.aggregate(most=Max('views'))['most'] or 0
+    if most_views * view_weight >= MIN_SCORE:
+        # Past this age even the most viewed row decays below MIN_SCORE.
+        hours = half_life * math.log2(most_views * view_weight / MIN_SCORE)
+        matched |= Q(views__gt=0, **{f'{created_field}__gte': at - timedelta(hours=hours)})
+    return matched
+
+
+def compute_scores(model, created_field, events, at=None):
+    """
+    Computes the trending score of every row of ``model`` that ``candidates`` selects.
+
+    ``events`` maps a weight name to ``(event model, foreign key attribute, timestamp field)``.
+    Every event in the window contributes its weight halved every ``TRENDING_HALF_LIFE``
+    hours. Views carry no timestamps, so a row's view count is decayed by its own age.
+    Returns ``(ids, new scores, stored scores)`` as NumPy arrays.
+    """
+    at = at or now()
+    half_life = getattr(settings, 'TRENDING_HALF_LIFE', 48)
+    since = at - timedelta(days=getattr(settings, 'TRENDING_WINDOW', 14))
+    weights = trending_weights()
+    rows = model.objects.filter(candidates(model, created_field, events, since, at, half_life, weights['view']))
+    at = at.timestamp()
+
+    ids, created, (views, stored) = _as_arrays(
+        rows.order_by('id').values_list('id', created_field, 'views', 'trending_score'), 4,
+    )
+    scores = weights['view'] * views * decay(created, at, half_life)
+    for name, (event_model, attname, time_field) in events.items():
+        event_ids, event_times, _ = _as_arrays(
+            event_model.objects.filter(**{f'{time_field}__gte': since}).values_list(attname, time_field), 2,
+        )
+        if len(event_ids) and len(ids):
+            scores += score_events(ids, event_ids, event_times, weights[name], at, half_life)
+    scores[scores < MIN_SCORE] = 0.0
+    return ids, scores, stored
+
+
+def store_scores(model, ids, scores, stored, batch_size=1000):
+    """Writes the scores that changed with bulk updates and returns how many rows were written."""
+    changed = np.flatnonzero(~np.isclose(scores, stored, rtol=1e-4, atol=MIN_SCORE / 10))
+    rows = [model(id=int(ids[i]), trending_score=float(scores[i])) for i in changed]
+    with transaction.atomic():
+        model.objects.bulk_update(rows, ['trending_score'], batch_size=batch_size)
+    return len(rows)
+
+
+def update_trending_scores(at=None):
+    """Recomputes the trending scores of all images and albums, returning the number of rows written per model."""
+    from .models import Album, AlbumFavorite, AlbumLike, Comment, Favorite, Image, Like
+
+    targets = [
+        (Image, 'uploaded_at', {
+            'like': (Like, 'image_id', 'liked_at'),
+            'favorite': (Favorite, 'image_id', 'added_at'),
+            'comment': (Comment, 'image_id', 'created_at'),
+        }),
+        (Album, 'created_at', {
+            'like': (AlbumLike, 'album_id', 'liked_at'),
+            'favorite': (AlbumFavorite, 'album_id', 'added_at'),
+        }),
+    ]
+    return {
+        model.__name__: store_scores(model, *compute_scores(model, created_field, events, at))
+        for model, created_field, events in targets
+    }
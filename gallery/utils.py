@@ -1,4 +1,5 @@
 from django.contrib.auth.decorators import user_passes_test
+from gallery.albumorder import append_image
 
 def staff_required(view_func):
     decorated_view_func = user_passes_test(lambda u: u.is_staff)(view_func)
@@ -7,7 +8,7 @@ def staff_required(view_func):
 def add_image_to_album(user, image, album_id):
     """Adds an image to the specified album."""
     album = Album.objects.get(id=album_id, user=user)
-    album.images.add(image)
+    append_image(album, image)
 
 def like_album_view(request, album_id):
     album = get_object_or_404(Album, id=album_id)
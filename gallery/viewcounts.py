@@ -0,0 +1,107 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """
+    Buffers view increments in process and writes them in batches, one
+    ``UPDATE ... SET views = views + n`` per group of rows sharing the same increment.
+
+    The buffer is swapped out before it is written, so a view is counted by exactly one
+    flush. A failed flush puts its counts back, and the buffer is flushed when the process
+    exits and emptied in forked children, which would otherwise write the parent's views
+    a second time.
+    """
+
+    def __init__(self):
+        self.pending = defaultdict(int)
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.flusher = None
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10)
+
+    @property
+    def max_pending(self):
+        return getattr(settings, 'VIEW_COUNT_MAX_PENDING', 1000)
+
+    def record(self, obj):
+        """Counts one view of ``obj``, an Image or an Album."""
+        with self.lock:
+            self.pending[obj._meta.label, obj.pk] += 1
+            due = (
+                len(self.pending) >= self.max_pending
+                or time.monotonic() - self.last_flush >= self.flush_interval
+            )
+            self._start_flusher()
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes every buffered view and returns the number of views written."""
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(int)
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        # Rows viewed the same number of times share one UPDATE.
+        groups = defaultdict(lambda: defaultdict(list))
+        for (label, pk), count in pending.items():
+            groups[label][count].append(pk)
+        try:
+            with transaction.atomic():
+                for label, by_count in groups.items():
+                    model = apps.get_model(label)
+                    for count, pks in by_count.items():
+                        model.objects.filter(pk__in=pks).update(views=F('views') + count)
+        except Exception:
+            logger.exception("Could not flush %d buffered view counts", len(pending))
+            with self.lock:
+                for key, count in pending.items():
+                    self.pending[key] += count
+            return 0
+        return sum(pending.values())
+
+    def _start_flusher(self):
+        # Called with the lock held. Bounds the delay before a view reaches the database
+        # when no further requests arrive to trigger a flush.
+        if self.flusher is None or not self.flusher.is_alive():
+            self.flusher = threading.Thread(target=self._run_flusher, name='view-count-flusher', daemon=True)
+            self.flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            connection.close()
+
+    def _reset_after_fork(self):
+        self.pending = defaultdict(int)
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.flusher = None
+
+
+view_counter = ViewCounter()
+
+atexit.register(view_counter.flush)
+os.register_at_fork(after_in_child=view_counter._reset_after_fork)
+
+
+def record_view(obj):
+    """Counts one view of an Image or an Album; the database is updated on the next flush."""
+    view_counter.record(obj)
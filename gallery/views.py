@@ -9,8 +9,6 @@ import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import Http404, HttpResponse, JsonResponse
 
-from django.core.paginator import Paginator
-from django.core.exceptions import PermissionDenied
 
 from django.contrib.auth import login
 from django.contrib.auth.models import User
@@ -21,15 +19,43 @@ from django.contrib.auth.decorators import login_required
 
 from .models import (
     Tag, Report, AlbumImage, add_image_to_album, Album, Follow, Image, 
-    get_image_visibility, UserProfile, search_images, Like, Favorite, Comment, 
+    UserProfile, search_images, Like, Favorite, Comment, 
     ModerationStatus, remove_from_favorites, add_to_favorites, add_like_to_album, 
-    add_album_to_favorites )
+    add_album_to_favorites, ModerationQueueItem )
 from .forms import (
     ReportForm, ImageUploadForm, UserRegistrationForm, UserProfileForm, 
     ImageUpdateForm, CommentForm )
 
-from django.db.models import OuterRef, Exists, Count, Case, When, BooleanField
+from django.db.models import Case, When, BooleanField, Prefetch, prefetch_related_objects
 from gallery.utils import staff_required, add_image_to_album
+from gallery.similarity import find_similar, find_similar_many
+from gallery.colors import filter_by_color, parse_hex
+from gallery.pagination import CursorPaginator
+from gallery.viewcounts import record_view
+from gallery.autocomplete import complete_tags
+from gallery.visibility import get_visibility_checker
+from gallery.pagecache import cache_anonymous_page
+from gallery.cards import render_cards
+from gallery.interaction_state import attach_interaction_state
+from gallery.moderation import QUEUE_ORDERING
+
+# Keyset orderings for each gallery filter; the trailing id keeps every cursor unique.
+IMAGE_ORDERINGS = {
+    'newest': ('-uploaded_at', '-id'),
+    'oldest': ('uploaded_at', 'id'),
+    'most_liked': ('-like_count', '-id'),
+    'most_favorited': ('-favorite_count', '-id'),
+    'trending': ('-trending_score', '-id'),
+}
+ALBUM_ORDERINGS = {
+    'newest': ('-created_at', '-id'),
+    'oldest': ('created_at', 'id'),
+    'most_liked': ('-like_count', '-id'),
+    'most_favorited': ('-favorite_count', '-id'),
+    'trending': ('-trending_score', '-id'),
+}
+COLOR_ORDERING = ('-color_score', '-id')
+SEARCH_ORDERING = ('-search_rank', '-id')
 
 #-----------------------------------#
 # Admin Views
@@ -38,26 +64,40 @@ from gallery.utils import staff_required, add_image_to_album
 @staff_required
 def admin_page(request):
     pending_images_count = Image.objects.filter(moderation_status=ModerationStatus.PENDING).count()
-    reported_images_count = Image.objects.filter(report__status='PENDING').distinct().count()
+    reported_images_count = ModerationQueueItem.objects.filter(image__isnull=False).count()
+    reported_comments_count = ModerationQueueItem.objects.filter(comment__isnull=False).count()
     return render(request, 'admin_page.html', {
         'pending_images_count': pending_images_count,
         'reported_images_count': reported_images_count,
+        'reported_comments_count': reported_comments_count,
     })
 
 @staff_required
 def admin_pending_images(request):
-    pending_images = Image.objects.filter(moderation_status=ModerationStatus.PENDING)
+    pending_images = list(Image.objects.filter(moderation_status=ModerationStatus.PENDING).select_related('user'))
+    # Flag likely reposts so moderators can compare them side by side.
+    duplicates = find_similar_many(pending_images, Image.objects.all(), k=5, max_distance=6)
+    for image in pending_images:
+        image.near_duplicates = duplicates[image.id]
     return render(request, 'admin_pending_images.html', {'pending_images': pending_images})
 
+def moderation_queue_page(request, field):
+    """One page of the reported images or comments, highest priority first, with each item's open reports."""
+    items = ModerationQueueItem.objects.filter(**{f'{field}__isnull': False}).select_related(field)
+    page_obj = CursorPaginator(items, 20, QUEUE_ORDERING).get_page(request.GET.get('cursor'))
+    prefetch_related_objects(
+        [getattr(item, field) for item in page_obj],
+        Prefetch('report_set', queryset=Report.objects.filter(status='PENDING').select_related('reported_by'), to_attr='pending_reports'),
+    )
+    return page_obj
+
 @staff_required
 def admin_reported_images(request):
-    reported_images = Image.objects.filter(report__status='PENDING').distinct()
-    return render(request, 'admin_reported_images.html', {'reported_images': reported_images})
+    return render(request, 'admin_reported_images.html', {'page_obj': moderation_queue_page(request, 'image')})
 
 @staff_required
 def admin_reported_comments(request):
-    reported_comments = Comment.objects.filter(report__status='PENDING').distinct()
-    return render(request, 'admin_reported_comments.html', {'reported_comments': reported_comments})
+    return render(request, 'admin_reported_comments.html', {'page_obj': moderation_queue_page(request, 'comment')})
 
 @staff_required
 def admin_user_management(request):
@@ -79,10 +119,19 @@ def search(request):
     query = request.GET.get('q')
     if query:
         images = search_images(query, user=request.user)
+        ordering = SEARCH_ORDERING
     else:
         images = Image.objects.get_filtered_images(user=request.user)
-    return render(request, 'search_results.html', {'images': images, 'query': query})
-
+        ordering = IMAGE_ORDERINGS['newest']
+    color = parse_hex(request.GET.get('color'))
+    if color:
+        images = filter_by_color(images, color)
+        ordering = COLOR_ORDERING
+    page_obj = CursorPaginator(images.select_related('user'), 20, ordering).get_page(request.GET.get('cursor'))
+    attach_interaction_state(page_obj.object_list, request.user)
+    return render(request, 'search_results.html', {'page_obj': page_obj, 'query': query, 'color': request.GET.get('color')})
+
+@cache_anonymous_page('gallery', lambda tag_id=None: [f'tag:{tag_id}'] if tag_id else ['images'])
 def gallery(request, tag_id=None):
     if tag_id:
         tag = get_object_or_404(Tag, id=tag_id)
@@ -92,57 +141,53 @@ def gallery(request, tag_id=None):
         images = Image.objects.get_filtered_images(request.user)
 
     filter_type = request.GET.get('filter', 'newest')
-    if filter_type == 'newest':
-        images = images.order_by('-uploaded_at')
-    elif filter_type == 'oldest':
-        images = images.order_by('uploaded_at')
-    elif filter_type == 'most_liked':
-        images = images.annotate(like_count=Count('liked_by')).order_by('-like_count')
-    elif filter_type == 'most_favorited':
-        images = images.annotate(favorite_count=Count('favorited_by')).order_by('-favorite_count')
-
-    if request.user.is_authenticated:    
-        # Annotate each image to see if the user has liked it
-        user_likes = Like.objects.filter(user=request.user, image=OuterRef('pk'))
-        user_favorites = Favorite.objects.filter(user=request.user, image=OuterRef('pk'))
-        images = images.annotate(
-            user_has_liked=Exists(user_likes),
-            user_has_favorited=Exists(user_favorites)    
-        )
-
-    paginator = Paginator(images, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    return render(request, 'gallery/gallery.html', {'page_obj': page_obj, 'tag': tag})
+    if filter_type not in IMAGE_ORDERINGS:
+        filter_type = 'newest'
+    ordering = IMAGE_ORDERINGS[filter_type]
+
+    # Colour search ranks images by how much of them is close to the requested colour.
+    color = parse_hex(request.GET.get('color'))
+    if color:
+        images = filter_by_color(images, color)
+        ordering = COLOR_ORDERING
 
+    page_obj = CursorPaginator(images.select_related('user'), 20, ordering).get_page(request.GET.get('cursor'))
+    attach_interaction_state(page_obj.object_list, request.user)
+
+    return render(request, 'gallery/gallery.html', {'page_obj': page_obj, 'cards': render_cards(page_obj.object_list), 'tag': tag})
+
+@cache_anonymous_page('album_gallery', lambda: ['albums'])
 def album_gallery(request):
     # Get filtered albums based on the current user
 
-    albums = Album.objects.get_filtered_albums(request.user)
+    albums = Album.objects.get_filtered_albums(request.user).select_related('cover_image')
     
 
     filter_type = request.GET.get('filter', 'newest')
-    if filter_type == 'newest':
-        albums = albums.order_by('-created_at')
-    elif filter_type == 'oldest':
-        albums = albums.order_by('created_at')
-    elif filter_type == 'most_liked':
-        albums = albums.annotate(like_count=Count('liked_by')).order_by('-like_count')
-    elif filter_type == 'most_favorited':
-        albums = albums.annotate(favorite_count=Count('favorited_by')).order_by('-favorite_count')
-    print(albums)
+    if filter_type not in ALBUM_ORDERINGS:
+        filter_type = 'newest'
     # Pagination: Show 20 albums per page
-    paginator = Paginator(albums, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = CursorPaginator(albums, 20, ALBUM_ORDERINGS[filter_type]).get_page(request.GET.get('cursor'))
     
     return render(request, 'album_gallery.html', {'page_obj': page_obj})
 
+@cache_anonymous_page('tags', lambda: ['tags'])
 def tags_view(request):
     tags = Tag.objects.all().order_by('name')
     return render(request, 'gallery/tags.html', {'tags': tags})
 
+def tag_autocomplete(request):
+    prefix = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid parameters'}, status=400)
+    results = complete_tags(prefix, limit) if prefix else []
+    return JsonResponse({
+        'success': True,
+        'results': [{'id': tag_id, 'name': name, 'count': count} for tag_id, name, count in results],
+    })
+
 #-----------------------------------#
 # Form Views
 #-----------------------------------#
@@ -244,16 +289,16 @@ def report_image_view(request, image_id):
 
 @login_required
 def profile(request):
-    user_profile = get_object_or_404(UserProfile, user=request.user)
-    user_images = Image.objects.filter(user=request.user) [:12]  # Display the latest 8 images
+    user_profile = get_object_or_404(UserProfile.objects.select_related('user'), user=request.user)
+    user_images = attach_interaction_state(Image.objects.filter(user=request.user).select_related('user')[:12], request.user)
     user_albums = Album.objects.filter(user=request.user) 
     return render(request, 'profile.html', {'user_profile': user_profile, 'user_images': user_images, 'user_albums': user_albums, 'is_following': False})
 
 @login_required
 def user_profile(request, username):
-    user_profile = get_object_or_404(UserProfile, user__username=username)
+    user_profile = get_object_or_404(UserProfile.objects.select_related('user'), user__username=username)
     user_images = Image.objects.filter(user=user_profile.user)
-    user_images = Image.objects.get_filtered_images(user=request.user).filter(id__in=user_images).order_by('-uploaded_at')[:12]
+    user_images = Image.objects.get_filtered_images(user=request.user).filter(id__in=user_images).select_related('user').order_by('-uploaded_at')[:12]
     user_albums = Album.objects.filter(user=user_profile.user) 
     is_following = Follow.objects.filter(follower=request.user, followed=user_profile.user).exists()
     
@@ -266,15 +311,14 @@ def user_profile(request, username):
 
 def user_gallery(request, username):
     user = get_object_or_404(User, username=username)
-    images = Image.objects.get_filtered_images(request.user).filter(user=user).order_by('-uploaded_at')
-    paginator = Paginator(images, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    images = Image.objects.get_filtered_images(request.user).filter(user=user).select_related('user')
+    page_obj = CursorPaginator(images, 20, IMAGE_ORDERINGS['newest']).get_page(request.GET.get('cursor'))
+    attach_interaction_state(page_obj.object_list, request.user)
     return render(request, 'user_gallery.html', {'page_obj': page_obj, 'user': user})
 
 @login_required
 def user_albums(request, username):
-    user_profile = get_object_or_404(UserProfile, user__username=username)
+    user_profile = get_object_or_404(UserProfile.objects.select_related('user'), user__username=username)
     user_albums = Album.objects.filter(user=user_profile.user)
     return render(request, 'user_albums.html', {'user_profile': user_profile, 'user_albums': user_albums})
 
@@ -298,20 +342,19 @@ def register(request):
 #-----------------------------------#
 
 def image_detail(request, image_id):
-    image = get_object_or_404(Image, id=image_id)
+    image = get_object_or_404(Image.objects.select_related('user__userprofile').prefetch_related('tags'), id=image_id)
 
-    if not request.user.is_staff:
-        if not get_image_visibility(request.user, image):
-            raise PermissionDenied("You do not have permission to view this image.")
+    get_visibility_checker(request).require(image)
     
     comment_form = CommentForm()
     if request.user.is_authenticated:
         user_albums = Album.objects.filter(user=request.user)
     else:
         user_albums = Album.objects.none()  # or handle the case when the user is not authenticated
+    record_view(image)
     # TODO: set up so user can select whether comments on their images are moderated or not.
     # comments = image.comments.filter(moderation_status=ModerationStatus.APPROVED)
-    comments = image.comments.all().order_by('-created_at')
+    comments = image.comments.select_related('user__userprofile').order_by('-created_at')
     return render(request, 'image_detail.html', {
         'image': image,
         'comment_form': comment_form,
@@ -319,7 +362,33 @@ def image_detail(request, image_id):
         'comments': comments,
     })
 
+def similar_images(request, image_id):
+    image = get_object_or_404(Image, id=image_id)
+    get_visibility_checker(request).require(image)
+    try:
+        k = min(int(request.GET.get('k', 10)), 50)
+        max_distance = min(int(request.GET.get('distance', 10)), 32)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid parameters'}, status=400)
+    matches = find_similar(image, Image.objects.get_filtered_images(request.user), k=k, max_distance=max_distance)
+    return JsonResponse({
+        'success': True,
+        'image_id': image.id,
+        'results': [
+            {'id': match.id, 'title': match.title, 'distance': distance, 'url': match.image_file.url}
+            for match, distance in matches
+        ],
+    })
+
 @login_required
 def album_detail(request, album_id):
     album = get_object_or_404(Album, id=album_id)
-    return render(request, 'album_detail.html', {'album': album})
+    checker = get_visibility_checker(request)
+    checker.require(album)
+    record_view(album)
+    album_images = [
+        album_image for album_image in album.albumimage_set.select_related('image')
+        if checker.can_view(album_image.image)
+    ]
+    attach_interaction_state([album_image.image for album_image in album_images], request.user)
+    return render(request, 'album_detail.html', {'album': album, 'album_images': album_images})
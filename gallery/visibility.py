@@ -0,0 +1,67 @@
+from django.core.exceptions import PermissionDenied
+
+from .follows import get_followed_ids
+
+
+class VisibilityChecker:
+    """
+    Decides which images and albums a viewer may see, applying the same privacy and
+    moderation rules as the gallery managers. The viewer's followed users are read from
+    the follow cache once, on the first ``followers``-only object, so checking any number
+    of objects costs at most one query. Answers are memoized per object.
+    """
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self._followed_ids = None
+        self._memo = {}
+
+    @property
+    def followed_ids(self):
+        if self._followed_ids is None:
+            self._followed_ids = set(get_followed_ids(self.viewer.pk)) if self.viewer.is_authenticated else set()
+        return self._followed_ids
+
+    def _decide(self, obj):
+        from .models import ModerationStatus
+
+        viewer = self.viewer
+        if viewer.is_staff or (viewer.is_authenticated and obj.user_id == viewer.pk):
+            return True
+        if obj.moderation_status != ModerationStatus.APPROVED:
+            return False
+        if obj.privacy == 'public':
+            return True
+        if obj.privacy == 'users':
+            return viewer.is_authenticated
+        if obj.privacy == 'followers':
+            return obj.user_id in self.followed_ids
+        return False
+
+    def can_view(self, obj):
+        key = (obj._meta.label, obj.pk)
+        if key not in self._memo:
+            self._memo[key] = self._decide(obj)
+        return self._memo[key]
+
+    def check_many(self, objs):
+        """Returns ``{pk: visible}`` for a list of images or albums of the same model."""
+        return {obj.pk: self.can_view(obj) for obj in objs}
+
+    def visible(self, objs):
+        """Returns the objects of ``objs`` the viewer may see, keeping their order."""
+        return [obj for obj in objs if self.can_view(obj)]
+
+    def require(self, obj):
+        """Raises ``PermissionDenied`` unless the viewer may see ``obj``."""
+        if not self.can_view(obj):
+            raise PermissionDenied(f"You do not have permission to view this {obj._meta.verbose_name}.")
+        return True
+
+
+def get_visibility_checker(request):
+    """Returns the checker memoized on ``request``, so every check in one request shares its follow set."""
+    checker = getattr(request, '_visibility_checker', None)
+    if checker is None or checker.viewer is not request.user:
+        checker = request._visibility_checker = VisibilityChecker(request.user)
+    return checker